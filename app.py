@@ -1,15 +1,41 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import os
-from yt_dlp import YoutubeDL
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room
+from werkzeug.middleware.proxy_fix import ProxyFix
+import collections
+import contextlib
+import functools
 import logging
+import shutil
+import socket
 import threading
+import time
+import uuid
+import jobs
+from jobs import make_job_store
+from executor import YT_DLP, BlockingExecutor, deadline_passed, hub_event, hub_popen
+from scheduler import DownloadScheduler, QueueFull
+from metadata_cache import normalize_video_key
+from metrics import MetricsRegistry, TraceLog
+from storage import StorageManager
+from serving import content_disposition_header, send_output_file, stream_zip
+from progress import ProgressFile, ProgressThrottle
+from ratelimit import AdmissionController, RateLimiter, retry_after_header
+from streaming import STREAM_FORMATS, build_ffmpeg_command, stream_ffmpeg
+from transcode import run_postprocessors
+from pipeline import (
+    DOWNLOAD_FORMATS, MP4_QUALITY_MAP, base_download_opts, choose_mp4_conversion, expand_playlist,
+    extract_video_info, extraction_opts, fetch_media, fetch_opts_for, fetched_source, init_worker,
+    make_metadata_cache, make_output_cache, plan_download, publish_output, select_formats, worker_stats,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+# With SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) events emitted by any
+# worker or node reach clients connected to any other, so gunicorn can run -w > 1.
+socketio = SocketIO(app, message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
 
 # --- IMPORTANT CHANGE ---
 # On Render, we can't reliably write to the user's home directory.
@@ -19,23 +45,314 @@ socketio = SocketIO(app)
 OUTPUT_DIR = os.path.join(os.getcwd(), "temp_downloads")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 logging.info(f"Output directory set to: {OUTPUT_DIR}")
+# When nginx fronts the app, set this to an internal location aliased to OUTPUT_DIR
+# (e.g. /protected_downloads/) and nginx will serve files itself via X-Accel-Redirect.
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+# Per-job scratch space for partial downloads and intermediate files
+WORK_DIR = os.path.join(OUTPUT_DIR, '.work')
+os.makedirs(WORK_DIR, exist_ok=True)
 
+# --- JOB STORE ---
+# Every download gets a job ID; the store records its status and exact output file.
+# Kept in SQLite next to the files by default, so jobs survive restarts and are
+# resumed on startup; set JOB_STORE_URL to a redis:// URL to share jobs between
+# nodes (which must then also share OUTPUT_DIR), or to memory:// to keep them in-process.
+JOB_STORE_URL = os.environ.get('JOB_STORE_URL', 'sqlite:///' + os.path.join(OUTPUT_DIR, '.jobs.sqlite3'))
+job_store = make_job_store(JOB_STORE_URL)
+# Jobs record the worker running them, which holds a lease on them: it refreshes their
+# 'updated' time every quarter of JOB_LEASE_SECONDS, and any worker (on any node) takes over
+# unfinished jobs whose lease ran out, i.e. whose worker died or was restarted. The lease
+# outlasts several renewals that each wait out the job store's busy timeout.
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+JOB_LEASE_SECONDS = max(int(os.environ.get('JOB_LEASE_SECONDS', 90)), 6 * jobs.BUSY_TIMEOUT)
 
-def progress_hook(d):
-    if d['status'] == 'downloading':
-        try:
-            # This function is called from a different thread, so we use socketio.emit
-            progress = d.get('_percent_str', '0%')
-            speed = d.get('_speed_str', 'N/A')
-            eta = d.get('_eta_str', 'N/A')
-            socketio.emit('download_progress', {
-                'progress': progress,
-                'speed': speed,
-                'eta': eta,
-                'filename': d.get('filename', '')
-            })
-        except Exception as e:
-            logging.error(f"Error in progress hook: {str(e)}")
+# --- METADATA CACHE ---
+# extract_info results are kept on disk (so they survive restarts) keyed by video ID.
+# Requests waiting for another request's extraction of the same video wait on the hub.
+metadata_cache = make_metadata_cache(make_event=hub_event(socketio.async_mode))
+
+# --- OUTPUT CACHE ---
+# Finished files are indexed by (video, format, quality, postprocessor settings)
+# so repeat requests are served straight from OUTPUT_DIR. Shared with bulk.py.
+output_cache = make_output_cache(OUTPUT_DIR)
+
+# --- STORAGE MANAGEMENT ---
+# OUTPUT_DIR is kept under a byte quota and a maximum age; a background janitor
+# evicts least recently downloaded files and leftovers of failed jobs. Every worker
+# runs one, and sees the others' pins (files being served, running jobs).
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 60))
+storage = StorageManager(
+    OUTPUT_DIR,
+    work_dir=WORK_DIR,
+    max_bytes=int(os.environ.get('STORAGE_MAX_BYTES', 2 * 1024 ** 3)),
+    max_age=int(os.environ.get('STORAGE_MAX_AGE', 6 * 3600)),
+    partial_grace=int(os.environ.get('STORAGE_PARTIAL_GRACE', 1800)),
+    on_evict=output_cache.forget_file,
+    # Pins are refreshed by every sweep, so they survive a few late ones
+    pin_ttl=5 * JANITOR_INTERVAL,
+)
+
+
+def report_queue_position(job_id, position):
+    # Stored too, so workers other than the one running the queue can report it
+    job_store.update(job_id, queue_position=position)
+    socketio.emit('download_queued', {'job_id': job_id, 'position': position}, to=job_id)
+
+
+def queue_position(job_id):
+    """Place of ``job_id`` in the fetch queue, whichever worker queued it."""
+    position = scheduler.position(job_id)
+    if position:
+        return position
+    job = job_store.get(job_id)
+    return job.get('queue_position', 0) if job is not None and job['status'] == jobs.QUEUED else 0
+
+
+FFMPEG_CONCURRENCY = int(os.environ.get('FFMPEG_CONCURRENCY', os.cpu_count() or 2))
+
+# yt-dlp is not imported with the app, so the worker is ready sooner; set YDL_POOL_WARM=false
+# to load it on the first download instead of in the background right after startup
+YDL_POOL_WARM = os.environ.get('YDL_POOL_WARM', 'true').lower() == 'true'
+YTDLP_PROCESSES = int(os.environ.get('YTDLP_PROCESSES', 4))
+
+# --- BLOCKING WORK ---
+# yt-dlp extraction and downloads run in a pool of YTDLP_PROCESSES worker processes
+# and ffmpeg postprocessing in another, so none of them can stall the eventlet hub
+# serving everyone else (nor trip over its monkey patching).
+# Fragment concurrency and chunk size are set in pipeline.py (CONCURRENT_FRAGMENTS,
+# HTTP_CHUNK_SIZE). All jobs of a yt-dlp worker share one keep-alive connection pool
+# per host (see http_pool.py), installed as soon as yt-dlp is loaded there.
+executor = BlockingExecutor(
+    socketio.async_mode,
+    threads=int(os.environ.get('WORKER_THREADS', 8)),
+    processes=FFMPEG_CONCURRENCY,
+    yt_dlp_processes=YTDLP_PROCESSES,
+    yt_dlp_initializer=functools.partial(
+        init_worker,
+        warm=YDL_POOL_WARM,
+        pool_hosts=int(os.environ.get('HTTP_POOL_HOSTS', 10)),
+        pool_size=int(os.environ.get('HTTP_POOL_SIZE', 32)),
+    ),
+)
+# Per-stage timeouts, in seconds
+EXTRACT_TIMEOUT = int(os.environ.get('EXTRACT_TIMEOUT', 60))
+FETCH_TIMEOUT = int(os.environ.get('FETCH_TIMEOUT', 1800))
+POSTPROCESS_TIMEOUT = int(os.environ.get('POSTPROCESS_TIMEOUT', 1800))
+
+# --- DOWNLOAD SCHEDULER ---
+# Jobs wait in a bounded queue; network fetches and ffmpeg postprocessing
+# each get their own concurrency limit so throughput stays flat under load.
+scheduler = DownloadScheduler(
+    socketio.start_background_task,
+    max_queued=int(os.environ.get('MAX_QUEUED_JOBS', 50)),
+    fetch_slots=int(os.environ.get('FETCH_CONCURRENCY', 3)),
+    ffmpeg_slots=FFMPEG_CONCURRENCY,
+    on_position=report_queue_position,
+)
+
+# --- RATE LIMITING ---
+# Each client (by IP) and each video get a token bucket (rate per second, burst);
+# a rate of 0 turns a limit off. Buckets are kept per worker process. A client
+# gets 0.5 requests/s with bursts of 20. A video's bucket (1/s, bursts of 10) is
+# only charged by requests that go upstream: an extraction, a fetch or a stream,
+# not answers from the metadata or output cache or from a running job.
+# Behind a reverse proxy (e.g. Render), set TRUSTED_PROXIES to the number of
+# proxies in front of the app so the client IP is taken from X-Forwarded-For.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+client_limiter = RateLimiter(
+    float(os.environ.get('CLIENT_RATE_LIMIT', 0.5)),
+    float(os.environ.get('CLIENT_RATE_BURST', 20)),
+)
+video_limiter = RateLimiter(
+    float(os.environ.get('VIDEO_RATE_LIMIT', 1)),
+    float(os.environ.get('VIDEO_RATE_BURST', 10)),
+)
+# New work is refused (429 with Retry-After) while the download queue is nearly
+# full, the load average per CPU is above ADMISSION_MAX_LOAD (0 disables) or
+# OUTPUT_DIR has less than ADMISSION_MIN_FREE_BYTES free.
+admission = AdmissionController(
+    scheduler.stats,
+    OUTPUT_DIR,
+    max_queue_fill=float(os.environ.get('ADMISSION_MAX_QUEUE_FILL', 0.9)),
+    max_load=float(os.environ.get('ADMISSION_MAX_LOAD', 4)),
+    min_free_bytes=int(os.environ.get('ADMISSION_MIN_FREE_BYTES', 256 * 1024 ** 2)),
+    retry_after=int(os.environ.get('ADMISSION_RETRY_AFTER', 10)),
+)
+
+# --- METRICS ---
+# Per-stage latencies, bytes and job outcomes of this process, served on /metrics in
+# the Prometheus text format (with several workers, each reports its own numbers).
+# Set JOB_TRACE_LOG to a file path to also get one JSON line per finished job.
+metrics = MetricsRegistry(prefix='ytdl_')
+stage_seconds = metrics.histogram(
+    'stage_duration_seconds', 'Time spent in each pipeline stage.', ['stage', 'outcome'],
+)
+bytes_total = metrics.counter(
+    'bytes_total', 'Bytes fetched from sources, produced by ffmpeg and served to clients.', ['kind'],
+)
+jobs_total = metrics.counter('jobs_total', 'Download requests by outcome.', ['outcome'])
+rejected_total = metrics.counter('rejected_requests_total', 'Requests refused with a 429, by reason.', ['reason'])
+ffmpeg_cpu_seconds = metrics.counter('ffmpeg_cpu_seconds_total', 'CPU time used by ffmpeg, by output format.', ['format'])
+metrics.gauge(
+    'queue_depth', 'Jobs waiting for a slot, by stage.',
+    lambda: {'fetch': scheduler.stats()['queued'], 'ffmpeg': scheduler.stats()['waiting_for_ffmpeg']}, 'stage',
+)
+metrics.gauge(
+    'active_jobs', 'Jobs holding a slot, by stage.',
+    lambda: {'fetch': scheduler.stats()['fetching'], 'ffmpeg': scheduler.stats()['postprocessing']}, 'stage',
+)
+metrics.gauge(
+    'cache_hit_ratio', 'Share of lookups answered from cache.',
+    lambda: {'metadata': metadata_cache.stats()['hit_rate'], 'output': output_cache.stats()['hit_rate']}, 'cache',
+)
+metrics.gauge('active_streams', 'Responses being streamed from ffmpeg.', lambda: active_streams)
+metrics.gauge('storage_bytes', 'Bytes of finished files in OUTPUT_DIR.', lambda: storage.usage()['bytes'])
+trace_log = TraceLog(os.environ.get('JOB_TRACE_LOG'))
+
+
+@contextlib.contextmanager
+def timed_stage(stage, trace=None):
+    """Record how long the ``with`` block takes as ``stage`` (and in the job's ``trace``)."""
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        seconds = time.monotonic() - started
+        stage_seconds.observe(seconds, stage=stage, outcome=outcome)
+        if trace is not None:
+            trace['stages'][stage] = round(seconds, 3)
+
+
+# --- BATCH DOWNLOADS ---
+# A batch (a list of URLs or a playlist) starts its items as ordinary jobs, at most
+# BATCH_CONCURRENCY at a time, and its finished files are handed out as one ZIP.
+batch_store = make_job_store(JOB_STORE_URL, namespace='batches')
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 3))
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', 200))
+# How often a batch checks on its jobs, in seconds
+BATCH_POLL_INTERVAL = 1.0
+
+
+# How many MP4 outputs needed no conversion, a remux or a full transcode
+mp4_conversions = collections.Counter()
+
+# Progress events per job are coalesced to at most this many per second
+PROGRESS_MAX_RATE = float(os.environ.get('PROGRESS_MAX_RATE', 4))
+
+# Streaming responses each hold an ffmpeg process for as long as the client reads
+MAX_STREAMS = int(os.environ.get('STREAM_CONCURRENCY', 4))
+active_streams = 0
+active_streams_lock = threading.Lock()
+# Their output is read on the hub, through pipes that don't block it
+stream_popen = hub_popen(socketio.async_mode)
+
+
+def extract_in_worker(url):
+    """Extraction for the metadata cache, in a yt-dlp worker process and with a timeout."""
+    logging.info(f"Extracting video info for: {url}")
+    with timed_stage('extract'):
+        return executor.run_in_process(
+            extract_video_info, url, extraction_opts(), EXTRACT_TIMEOUT,
+            timeout=EXTRACT_TIMEOUT, stage='extract', pool=YT_DLP,
+        )
+
+
+def too_many_requests(error, retry_after):
+    """429 response telling the client to come back in ``retry_after`` seconds."""
+    seconds = retry_after_header(retry_after)
+    response = jsonify({'success': False, 'error': error, 'retry_after': int(seconds)})
+    response.status_code = 429
+    response.headers['Retry-After'] = seconds
+    return response
+
+
+VIDEO_RATE_LIMITED = 'This video is being requested too often, please try again shortly.'
+
+
+def throttle(admit=False):
+    """Apply the per-client rate limit, and admission control if ``admit``.
+
+    Returns a 429 response if the request has to be turned away, else None.
+    """
+    client = request.remote_addr or 'unknown'
+    wait = client_limiter.acquire(client)
+    if wait:
+        rejected_total.inc(reason='client')
+        logging.warning(f"Rate limited client {client} on {request.path}")
+        return too_many_requests('Too many requests, please slow down.', wait)
+    if admit:
+        rejection = admission.check()
+        if rejection:
+            reason, wait = rejection
+            rejected_total.inc(reason=reason)
+            logging.warning(f"Refusing new work on {request.path}: node is saturated ({reason})")
+            return too_many_requests('Server is busy, please try again shortly.', wait)
+    return None
+
+
+def charge_video(video_url):
+    """Take a token from ``video_url``'s bucket for work that goes upstream.
+
+    Returns the seconds to wait if the video is over its limit, else 0.
+    """
+    wait = video_limiter.acquire(normalize_video_key(video_url))
+    if wait:
+        rejected_total.inc(reason='video')
+        logging.warning(f"Rate limited requests for {video_url}")
+    return wait
+
+
+def subscribe_to_job(sid, job_id):
+    """Put Socket.IO client ``sid`` in the room that receives ``job_id``'s events."""
+    if sid:
+        socketio.server.enter_room(sid, job_id, namespace='/')
+
+
+def job_progress_hook(progress):
+    """Throttled progress hook posting into ``progress``; aborts the download once the fetch is past its deadline.
+
+    yt-dlp also calls it from its fragment download threads, which the deadline's alarm does not reach.
+    """
+    return ProgressThrottle(progress.put, max_rate=PROGRESS_MAX_RATE, should_stop=deadline_passed)
+
+
+# Fetch percent of this process's running jobs, for aggregate (batch) progress. Only kept
+# in memory: writing it to the job store on every update would hit SQLite from the hub
+live_progress = {}
+
+
+def pump_progress(job_id, progress):
+    """Forward progress posted from a yt-dlp worker to the clients following ``job_id``."""
+    interval = 1.0 / PROGRESS_MAX_RATE if PROGRESS_MAX_RATE > 0 else 0.25
+    try:
+        while True:
+            closed = progress.closed
+            payload = progress.take()
+            if payload is not None:
+                socketio.emit('download_progress', {'job_id': job_id, **payload}, to=job_id)
+                live_progress[job_id] = payload['p']
+            if closed:
+                break
+            socketio.sleep(interval)
+    finally:
+        live_progress.pop(job_id, None)
+
+
+@socketio.on('subscribe_job')
+def subscribe_job(data):
+    """Let a (re)connected client follow a job; replies with the job's current status."""
+    job_id = (data or {}).get('job_id')
+    # Batch IDs are accepted too, for batch_progress events
+    job = (job_store.get(job_id) or batch_store.get(job_id)) if job_id else None
+    if job is None:
+        return {'success': False, 'error': 'Unknown job'}
+    join_room(job_id)
+    job.pop('output_key', None)
+    return {'success': True, 'job': job}
 
 @app.route('/')
 def index():
@@ -46,17 +363,42 @@ def index():
 def download_file(filename):
     """
     This route serves the downloaded file to the user.
+    Accepts a job ID (preferred, O(1) lookup in the job store) or a plain filename.
     """
+    job = job_store.get(filename)
+    if job is not None:
+        if job['status'] != jobs.FINISHED:
+            return "File not ready.", 404
+        # Jobs that produced several formats take ?format= to pick one
+        output_format = request.args.get('format')
+        filename = (job.get('outputs') or {}).get(output_format) if output_format else job['filename']
+        if not filename:
+            return "File not found.", 404
     logging.info(f"Serving file: {filename} from directory: {OUTPUT_DIR}")
-    try:
-        return send_from_directory(
-            OUTPUT_DIR,
-            filename,
-            as_attachment=True # This tells the browser to prompt a download
-        )
-    except FileNotFoundError:
+    started = time.monotonic()
+
+    def finish_serving():
+        storage.unpin(filename)
+        stage_seconds.observe(time.monotonic() - started, stage='serve', outcome='ok')
+
+    # Keep the janitor away from the file until the response has been sent
+    storage.pin(filename)
+    # Supports Range/If-Range for resumable downloads, ETag/If-None-Match, and
+    # zero-copy sendfile (or nginx X-Accel-Redirect offload when configured)
+    response = send_output_file(
+        OUTPUT_DIR,
+        filename,
+        on_close=finish_serving,
+        accel_prefix=X_ACCEL_REDIRECT_PREFIX,
+    )
+    if response is None:
         logging.error(f"File not found: {filename}")
         return "File not found.", 404
+    if response.status_code in (200, 206):
+        bytes_total.inc(int(response.headers.get('Content-Length') or 0), kind='served')
+
+    storage.touch(filename)
+    return response
 
 
 @app.route('/get_download_url', methods=['POST'])
@@ -68,199 +410,680 @@ def get_download_url():
     
     if not video_url:
         return jsonify({'success': False, 'error': 'URL is required'})
-
-    cookies_path = os.path.join(os.getcwd(), 'cookies.txt')
-    base_opts = {
-        'nocheckcertificate': True,
-        'quiet': True,  # Reduce noise for URL extraction
-        # Use mweb client as recommended for current YouTube issues
-        'extractor_args': {
-            'youtube': {
-                'client': ['mweb'],
-                'lang': ['en'],
-                'region': ['US']
-            }
-        },
-        # Use a realistic user agent
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-    }
-    if os.path.exists(cookies_path):
-        logging.info("Using cookies.txt file for authentication.")
-        base_opts['cookiefile'] = cookies_path
+    rejected = throttle()
+    if rejected:
+        return rejected
+    wait = 0 if metadata_cache.contains(video_url) else charge_video(video_url)
+    if wait:
+        return too_many_requests(VIDEO_RATE_LIMITED, wait)
 
     try:
-        # Extract video info to validate URL and get title
-        ydl_opts = base_opts.copy()
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            logging.info(f"Extracting video info for: {video_url}")
-            logging.info(f"Requested format: {format_type}, quality: {quality}")
-            
-            # Extract video info without downloading
-            info = ydl.extract_info(video_url, download=False)
-            
-            title = info.get('title', 'Unknown')
-            logging.info(f"Successfully extracted info for: {title}")
-            
-            # Always use server processing for consistent downloads
-            # This ensures files are downloaded directly to user's device without redirects
-            return jsonify({
-                'success': True,
-                'needs_processing': True,
-                'title': title,
-                'format': format_type,
-                'message': f'{format_type.upper()} will be processed on server for direct download'
-            })
+        logging.info(f"Requested format: {format_type}, quality: {quality}")
+        # Popular links are served from the metadata cache instead of being re-extracted
+        with timed_stage('lookup'):
+            info = metadata_cache.get_or_extract(video_url, extract_in_worker)
+
+        title = info.get('title', 'Unknown')
+        logging.info(f"Successfully extracted info for: {title}")
+
+        # Always use server processing for consistent downloads
+        # This ensures files are downloaded directly to user's device without redirects
+        return jsonify({
+            'success': True,
+            'needs_processing': True,
+            'title': title,
+            'format': format_type,
+            # Passed back to /download so it can skip a second extraction
+            'info_handle': metadata_cache.issue_handle(video_url),
+            'message': f'{format_type.upper()} will be processed on server for direct download'
+        })
 
     except Exception as e:
         logging.error(f"Error extracting video info: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+
+@app.route('/stream')
+def stream():
+    """Opt-in streaming download: pipe ffmpeg output straight into the response.
+
+    Nothing is written to OUTPUT_DIR; the first bytes go out as soon as the
+    stream has been extracted, at the cost of no resume and no output cache.
+    Query parameters: url, format (mp3/wav/mp4), quality, info_handle.
+    """
+    global active_streams
+    video_url = request.args.get('url')
+    format_type = request.args.get('format', 'mp3')
+    quality = request.args.get('quality', 'best')
+    info_handle = request.args.get('info_handle')
+
+    if not video_url:
+        return jsonify({'success': False, 'error': 'URL is required'}), 400
+    if format_type not in STREAM_FORMATS:
+        return jsonify({'success': False, 'error': 'Invalid format'}), 400
+    rejected = throttle(admit=True)
+    if rejected:
+        return rejected
+    # A stream always reads from upstream, cached info or not
+    wait = charge_video(video_url)
+    if wait:
+        return too_many_requests(VIDEO_RATE_LIMITED, wait)
+
+    try:
+        info = metadata_cache.resolve_handle(info_handle, video_url) if info_handle else None
+        if info is None:
+            info = metadata_cache.get_or_extract(video_url, extract_in_worker)
+        selector = MP4_QUALITY_MAP.get(quality, MP4_QUALITY_MAP['best']) if format_type == 'mp4' else 'bestaudio/best'
+        info = executor.run_in_process(
+            select_formats, info, {**extraction_opts(), 'format': selector}, EXTRACT_TIMEOUT,
+            timeout=EXTRACT_TIMEOUT, stage='extract', pool=YT_DLP,
+        )
+    except Exception as e:
+        logging.error(f"Error preparing stream for {video_url}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 502
+
+    with active_streams_lock:
+        if active_streams >= MAX_STREAMS:
+            return too_many_requests('Server is busy, please try again shortly.', admission.retry_after)
+        active_streams += 1
+
+    def generate():
+        global active_streams
+        try:
+            yield from stream_ffmpeg(build_ffmpeg_command(info, format_type), popen=stream_popen)
+        finally:
+            with active_streams_lock:
+                active_streams -= 1
+
+    _, mimetype = STREAM_FORMATS[format_type]
+    download_name = f"{info.get('title', 'download')}.{format_type}"
+    logging.info(f"Streaming {format_type.upper()} for {video_url}")
+    # No Content-Length: the response goes out with chunked transfer encoding
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': content_disposition_header(download_name)},
+    )
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Current status of a download job."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    job.pop('output_key', None)
+    if job['status'] == jobs.QUEUED:
+        job['queue_position'] = queue_position(job_id)
+    if job_id in live_progress:
+        job['progress'] = live_progress[job_id]
+    if job['status'] == jobs.FINISHED:
+        job['download_url'] = f"/download_file/{job_id}"
+        job['download_urls'] = {fmt: f"/download_file/{job_id}?format={fmt}" for fmt in job.get('outputs') or {}}
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/stats')
+def stats():
+    """Scheduler and cache counters, handy for checking the effect of tuning."""
+    return jsonify({
+        'scheduler': scheduler.stats(),
+        'metadata_cache': metadata_cache.stats(),
+        'output_cache': output_cache.stats(),
+        'storage': storage.usage(),
+        'jobs': job_store.counts(),
+        'mp4_conversions': dict(mp4_conversions),
+        'rate_limits': {'client': client_limiter.stats(), 'video': video_limiter.stats()},
+        'admission': admission.stats(),
+    })
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics of this worker in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def start_download(video_url, formats, quality='best', info_handle=None, sid=None, job_id=None,
+                   rate_limited=False, **job_fields):
+    """Start a download job for ``video_url`` in each of ``formats``.
+
+    Answers from the output cache or attaches to a running job when it can.
+    Passing the ``job_id`` of an interrupted job runs it again in its old work
+    directory. With ``rate_limited``, a new job is charged to the video's rate
+    limit. Returns the JSON payload for the client and the HTTP status.
+    """
+    try:
+        opts_by_format, ydl_opts, output_keys = plan_download(video_url, formats, quality, base_download_opts())
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}, 200
+    format_type = formats[0]
+    job_id = job_id or uuid.uuid4().hex
+    output_key = output_keys[format_type]
+
+    # Identical requests are answered from the output cache without touching yt-dlp or ffmpeg
+    outputs = {}
+    for fmt, key in output_keys.items():
+        cached_filename = output_cache.lookup(key)
+        if cached_filename:
+            logging.info(f"Output cache hit for {video_url} ({fmt}, {quality}): {cached_filename}")
+            outputs[fmt] = cached_filename
+    if len(outputs) == len(formats):
+        cached_filename = outputs[format_type]
+        job_store.create(
+            job_id, url=video_url, format=format_type, formats=formats, quality=quality,
+            output_key=output_key, status=jobs.FINISHED, filename=cached_filename, outputs=outputs,
+            owner=WORKER_ID, **job_fields,
+        )
+        subscribe_to_job(sid, job_id)
+        jobs_total.inc(outcome='cached')
+        socketio.emit('download_complete', {
+            'success': True,
+            'job_id': job_id,
+            'filename': cached_filename,
+            'outputs': outputs,
+        }, to=job_id)
+        return {
+            'success': True, 'job_id': job_id, 'cached': True, 'filename': cached_filename, 'outputs': outputs,
+        }, 200
+
+    # ...and requests for an output that is already being produced share that job
+    if len(formats) == 1:
+        running_job_id = output_cache.claim(output_key, job_id)
+        running_job = job_store.get(running_job_id) if running_job_id else None
+        if running_job_id and (running_job is None or running_job['status'] in (jobs.FINISHED, jobs.ERROR)):
+            # The claim outlived its job (e.g. the worker running it was restarted)
+            logging.warning(f"Dropping stale claim of job {running_job_id} on {video_url}")
+            output_cache.release(output_key)
+            running_job_id = output_cache.claim(output_key, job_id)
+        if running_job_id:
+            logging.info(f"Attaching request for {video_url} to running job {running_job_id}")
+            subscribe_to_job(sid, running_job_id)
+            jobs_total.inc(outcome='attached')
+            return {
+                'success': True,
+                'job_id': running_job_id,
+                'attached': True,
+                'queue_position': queue_position(running_job_id),
+                'message': 'Download already in progress...',
+            }, 200
+        claimed_keys = [output_key]
+    else:
+        # A fan-out job produces its missing formats itself (one fetch for all of
+        # them is cheaper than waiting on other jobs); it only claims free keys.
+        claimed_keys = [
+            key for fmt, key in output_keys.items()
+            if fmt not in outputs and output_cache.claim(key, job_id) is None
+        ]
+    pending_formats = [fmt for fmt in formats if fmt not in outputs]
+
+    # Each job works in its own directory so concurrent jobs never share
+    # intermediate files; only the finished file is moved into OUTPUT_DIR.
+    work_dir = os.path.join(WORK_DIR, job_id)
+    fetch_opts = fetch_opts_for(opts_by_format, ydl_opts, work_dir)
+
+    # What the job spent its time on, for the metrics and the trace log
+    trace = {
+        'job_id': job_id, 'url': video_url, 'formats': formats, 'quality': quality,
+        'stages': {}, 'bytes': {}, 'ffmpeg_cpu_seconds': {},
+    }
+    queued_at = time.monotonic()
+
+    def release_claims():
+        for key in claimed_keys:
+            output_cache.release(key)
+
+    def finish_trace(outcome, error=None):
+        jobs_total.inc(outcome=outcome)
+        trace_log.write({**trace, 'outcome': outcome, 'error': error, 'finished': time.time()})
+
+    def do_fetch():
+        queue_seconds = time.monotonic() - queued_at
+        stage_seconds.observe(queue_seconds, stage='queue', outcome='ok')
+        trace['stages']['queue'] = round(queue_seconds, 3)
+        job_store.update(job_id, status=jobs.FETCHING)
+        logging.info(f"Starting {'/'.join(formats).upper()} download for URL: {video_url} (job {job_id})")
+        if 'mp4' in formats:
+            logging.info("Using HLS/m3u8-compatible format selection with MP4 conversion")
+        # Reuse the info dict extracted by /get_download_url when we have it
+        info = metadata_cache.resolve_handle(info_handle, video_url) if info_handle else None
+        if info is not None:
+            logging.info(f"Reusing extracted info for {video_url}, skipping extraction")
+
+        # yt-dlp runs in a worker process; its progress reaches the job's room through
+        # a file in the work directory polled by a green task on the hub
+        progress = ProgressFile(os.path.join(work_dir, '.progress.json'))
+        socketio.start_background_task(pump_progress, job_id, progress)
+        opts = {**fetch_opts, 'progress_hooks': [job_progress_hook(progress)]}
+        try:
+            with timed_stage('fetch', trace):
+                info, reextracted = executor.run_in_process(
+                    fetch_media, opts, video_url, info, FETCH_TIMEOUT,
+                    timeout=FETCH_TIMEOUT, stage='fetch', pool=YT_DLP,
+                )
+        finally:
+            progress.closed = True
+        if reextracted:
+            logging.warning(f"Cached info for {video_url} failed to download, extracted again")
+        logging.info(f"Download info extracted: {info.get('title', 'Unknown')}")
+        logging.info(f"Requested formats: {', '.join(formats).upper()}, Quality: {quality}")
+        _, fetched = fetched_source(info)
+        bytes_total.inc(fetched, kind='fetched')
+        trace['bytes']['fetched'] = fetched
+        job_store.update(job_id, status=jobs.DOWNLOADED, title=info.get('title'), progress=100.0)
+        return info
+
+    def do_postprocess(info):
+        job_store.update(job_id, status=jobs.POSTPROCESSING)
+        source_path, _ = fetched_source(info)
+        logging.info(f"Running postprocessors for {', '.join(pending_formats).upper()} on: {source_path}")
+        if 'mp4' in pending_formats:
+            mp4_conversion = choose_mp4_conversion(info, opts_by_format)
+            mp4_conversions[mp4_conversion] += 1
+            job_store.update(job_id, mp4_conversion=mp4_conversion)
+            trace['mp4_conversion'] = mp4_conversion
+            logging.info(f"MP4 output for job {job_id} takes the '{mp4_conversion}' path")
+        started = time.monotonic()
+        # ffmpeg runs in the process pool, one encode per format in parallel; each
+        # gives back the info dict's final 'filepath' (the path yt-dlp hands to its post_hooks)
+        arg_lists = [(opts_by_format[fmt], info, source_path, POSTPROCESS_TIMEOUT) for fmt in pending_formats]
+        with timed_stage('postprocess', trace):
+            if len(arg_lists) == 1:
+                # The usual single-format job: one encode, no fan-out to wait on
+                try:
+                    outcomes = [(executor.run_in_process(
+                        run_postprocessors, *arg_lists[0], timeout=POSTPROCESS_TIMEOUT, stage='postprocess',
+                    ), None)]
+                except Exception as e:
+                    outcomes = [(None, e)]
+            else:
+                outcomes = executor.map_in_process(
+                    run_postprocessors, arg_lists, timeout=POSTPROCESS_TIMEOUT, stage='postprocess',
+                )
+        postprocess_seconds = round(time.monotonic() - started, 3)
+        errors = {}
+        for fmt, (result, error) in zip(pending_formats, outcomes):
+            if error is None:
+                final_path, cpu_seconds = result
+                ffmpeg_cpu_seconds.inc(cpu_seconds, format=fmt)
+                trace['ffmpeg_cpu_seconds'][fmt] = round(cpu_seconds, 3)
+                try:
+                    base_filename, size = publish_output(final_path, OUTPUT_DIR)
+                except Exception as e:
+                    error = e
+            if error is not None:
+                logging.error(f"{fmt.upper()} output failed for job {job_id}: {str(error)}")
+                errors[fmt] = str(error)
+                continue
+            logging.info(f"File size: {size} bytes")
+            bytes_total.inc(size, kind='produced')
+            trace['bytes'][fmt] = size
+            output_cache.store(output_keys[fmt], base_filename)
+            outputs[fmt] = base_filename
+        shutil.rmtree(work_dir, ignore_errors=True)
+        storage.unpin(work_dir)
+        if errors and len(errors) == len(pending_formats):
+            raise Exception(next(iter(errors.values())))
+
+        # The first requested format that was produced stands in for the job's file
+        base_filename = next(outputs[fmt] for fmt in formats if fmt in outputs)
+        logging.info(f"Download complete. Final filename: {base_filename}")
+        release_claims()
+        job_store.update(
+            job_id, status=jobs.FINISHED, filename=base_filename, outputs=outputs, errors=errors,
+            postprocess_seconds=postprocess_seconds,
+        )
+        finish_trace('finished', errors or None)
+
+        socketio.emit('download_complete', {
+            'success': True,
+            'job_id': job_id,
+            'filename': base_filename,
+            'outputs': outputs,
+        }, to=job_id)
+
+    def on_error(e):
+        release_claims()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        storage.unpin(work_dir)
+        job_store.update(job_id, status=jobs.ERROR, error=str(e))
+        logging.error(f"Error during download job {job_id}: {str(e)}")
+        import traceback
+        logging.error(f"Full traceback: {traceback.format_exc()}")
+        finish_trace('error', str(e))
+        socketio.emit('download_error', {'job_id': job_id, 'error': str(e)}, to=job_id)
+
+    wait = charge_video(video_url) if rate_limited else 0
+    if wait:
+        release_claims()
+        return {'success': False, 'error': VIDEO_RATE_LIMITED, 'retry_after': wait}, 429
+
+    job_store.create(
+        job_id, url=video_url, format=format_type, formats=formats, quality=quality,
+        output_key=output_key, outputs=dict(outputs), owner=WORKER_ID, **job_fields,
+    )
+    subscribe_to_job(sid, job_id)
+    storage.pin(work_dir)
+    try:
+        position = scheduler.submit(job_id, do_fetch, do_postprocess, on_error)
+    except QueueFull as e:
+        release_claims()
+        storage.unpin(work_dir)
+        job_store.update(job_id, status=jobs.ERROR, error=str(e))
+        logging.warning(f"Rejecting download for {video_url}: {str(e)}")
+        rejected_total.inc(reason='queue')
+        return {'success': False, 'error': 'Server is busy, please try again shortly.', 'retry_after': admission.retry_after}, 429
+
+    logging.info(f"Queued download job {job_id} at position {position}")
+    # Immediately return success to the client, the actual result comes via socket
+    return {
+        'success': True,
+        'job_id': job_id,
+        'queue_position': position,
+        'message': 'Download started...' if position == 0 else f'Queued at position {position}...',
+    }, 200
+
+
 @app.route('/download', methods=['POST'])
 def download():
-    """Fallback server-side download for audio formats that need processing"""
+    """Fallback server-side download for audio formats that need processing.
+
+    ``format`` names one output format; ``formats`` may list several, which
+    are all encoded from a single fetch of the source.
+    """
     video_url = request.json.get('url')
     format_type = request.json.get('format')
     quality = request.json.get('quality', 'best')
+    info_handle = request.json.get('info_handle')
+    # Socket.IO session of the caller; job events are only sent to subscribed clients
+    sid = request.json.get('sid')
+    formats = list(dict.fromkeys(request.json.get('formats') or [format_type]))
     
     if not video_url:
         return jsonify({'success': False, 'error': 'URL is required'})
-
-    cookies_path = os.path.join(os.getcwd(), 'cookies.txt')
-    base_opts = {
-        'outtmpl': os.path.join(OUTPUT_DIR, '%(title)s.%(ext)s'),
-        'progress_hooks': [progress_hook],
-        'nocheckcertificate': True,
-        # Use mweb client as recommended for current YouTube issues
-        'extractor_args': {
-            'youtube': {
-                'client': ['mweb'],
-                'lang': ['en'],
-                'region': ['US']
-            }
-        },
-        # Use a realistic user agent
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-    }
-    if os.path.exists(cookies_path):
-        logging.info("Using cookies.txt file for authentication.")
-        base_opts['cookiefile'] = cookies_path
+    rejected = throttle(admit=True)
+    if rejected:
+        return rejected
 
     try:
-        # Determine format options
-        if format_type == 'mp3':
-            ydl_opts = {
-                **base_opts,
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-            }
-        elif format_type == 'mp4':
-            # Use yt-dlp's native HLS/m3u8 handling - it can download and convert to MP4
-            # More robust format selection that handles HLS streams
-            quality_map = {
-                '1080p': 'best[height<=1080]/bestvideo[height<=1080]+bestaudio/best',
-                '720p': 'best[height<=720]/bestvideo[height<=720]+bestaudio/best', 
-                '480p': 'best[height<=480]/bestvideo[height<=480]+bestaudio/best',
-                '360p': 'best[height<=360]/bestvideo[height<=360]+bestaudio/best',
-                'best': 'best/bestvideo+bestaudio/best',
-            }
-            ydl_opts = {
-                **base_opts,
-                'format': quality_map.get(quality, quality_map['best']),
-                'merge_output_format': 'mp4',  # Force final output to be MP4
-                'outtmpl': os.path.join(OUTPUT_DIR, '%(title)s.mp4'),  # Force MP4 extension in filename
-                'postprocessors': [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }],
-            }
-        elif format_type == 'wav':
-            ydl_opts = {
-                **base_opts,
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'wav',
-                }],
-            }
-        else:
-            return jsonify({'success': False, 'error': 'Invalid format'})
-
-        with YoutubeDL(ydl_opts) as ydl:
-            # We run the download in a separate thread so the main request can finish.
-            # The result is communicated back via Socket.IO.
-            def do_download():
-                try:
-                    logging.info(f"Starting {format_type.upper()} download for URL: {video_url}")
-                    if format_type == 'mp4':
-                        logging.info("Using HLS/m3u8-compatible format selection with MP4 conversion")
-                    info = ydl.extract_info(video_url, download=True)
-                    logging.info(f"Download info extracted: {info.get('title', 'Unknown')}")
-                    logging.info(f"Requested format: {format_type.upper()}, Quality: {quality}")
-                    
-                    # --- FILENAME LOGIC ---
-                    # We need the final filename after post-processing
-                    filename = ydl.prepare_filename(info)
-                    logging.info(f"Initial filename: {filename}")
-                    
-                    if format_type in ['mp3', 'wav']:
-                        # For audio formats, the extension changes.
-                        filename = os.path.splitext(filename)[0] + '.' + format_type
-                    elif format_type == 'mp4':
-                        # For MP4, ensure the extension is .mp4 (especially for HLS/m3u8 conversions)
-                        filename = os.path.splitext(filename)[0] + '.mp4'
-                    
-                    base_filename = os.path.basename(filename)
-                    full_path = os.path.join(OUTPUT_DIR, base_filename)
-                    
-                    # Check if file actually exists
-                    if os.path.exists(full_path):
-                        logging.info(f"Download complete. Final filename: {base_filename}")
-                        logging.info(f"File size: {os.path.getsize(full_path)} bytes")
-                        
-                        socketio.emit('download_complete', {
-                            'success': True,
-                            'filename': base_filename,
-                        })
-                    else:
-                        # Try to find the actual file that was created
-                        actual_files = [f for f in os.listdir(OUTPUT_DIR) if f.startswith(os.path.splitext(base_filename)[0])]
-                        if actual_files:
-                            actual_filename = actual_files[0]
-                            logging.info(f"Found actual file: {actual_filename}")
-                            socketio.emit('download_complete', {
-                                'success': True,
-                                'filename': actual_filename,
-                            })
-                        else:
-                            raise Exception(f"Downloaded file not found. Expected: {base_filename}")
-                    
-                except Exception as e:
-                    logging.error(f"Error during download thread: {str(e)}")
-                    import traceback
-                    logging.error(f"Full traceback: {traceback.format_exc()}")
-                    socketio.emit('download_error', {'error': str(e)})
-
-            # Use socketio.start_background_task for proper handling
-            logging.info("Starting background download task")
-            socketio.start_background_task(do_download)
-
-        # Immediately return success to the client, the actual result comes via socket
-        return jsonify({'success': True, 'message': 'Download started...'})
+        result, status = start_download(video_url, formats, quality, info_handle, sid, rate_limited=True)
+        if status == 429:
+            return too_many_requests(result['error'], result['retry_after'])
+        return jsonify(result), status
 
     except Exception as e:
         logging.error(f"Error in /download route: {str(e)}")
-        socketio.emit('download_error', {'error': str(e)})
+        if sid:
+            socketio.emit('download_error', {'error': str(e)}, to=sid)
         return jsonify({'success': False, 'error': str(e)})
 
+def run_batch(batch_id, items, formats, quality):
+    """Start a batch's items as jobs, at most BATCH_CONCURRENCY at a time, and report aggregate progress."""
+    done = (jobs.FINISHED, jobs.ERROR)
+    last_report = None
+    while True:
+        for item in items:
+            if item['job_id'] and item['status'] not in done:
+                job = job_store.get(item['job_id'])
+                if job is None:
+                    item.update(status=jobs.ERROR, error='Job expired')
+                    continue
+                item.update(
+                    status=job['status'], error=job['error'], filename=job['filename'],
+                    outputs=job.get('outputs') or {},
+                    progress=live_progress.get(item['job_id'], job.get('progress') or 0),
+                )
+
+        running = sum(1 for item in items if item['job_id'] and item['status'] not in done)
+        for item in items:
+            if running >= BATCH_CONCURRENCY:
+                break
+            if item['job_id'] or item['status'] in done:
+                continue
+            try:
+                result, status = start_download(item['url'], formats, quality)
+            except Exception as e:
+                result, status = {'success': False, 'error': str(e)}, 500
+            if status == 429:
+                # The scheduler queue is full; try again on the next round
+                break
+            if not result.get('success'):
+                item.update(status=jobs.ERROR, error=result.get('error'))
+                continue
+            item.update(job_id=result['job_id'], status=jobs.QUEUED)
+            running += 1
+
+        finished = sum(1 for item in items if item['status'] == jobs.FINISHED)
+        failed = sum(1 for item in items if item['status'] == jobs.ERROR)
+        percent = sum(100.0 if item['status'] in done else item['progress'] for item in items) / len(items)
+        report = {'batch_id': batch_id, 'total': len(items), 'finished': finished, 'failed': failed, 'p': round(percent, 1)}
+        if report != last_report:
+            socketio.emit('batch_progress', report, to=batch_id)
+            last_report = report
+        batch_store.update(batch_id, items=[dict(item) for item in items], finished=finished, failed=failed, progress=report['p'])
+        if finished + failed == len(items):
+            break
+        socketio.sleep(BATCH_POLL_INTERVAL)
+
+    logging.info(f"Batch {batch_id} done: {finished} finished, {failed} failed")
+    batch_store.update(batch_id, status=jobs.FINISHED if finished else jobs.ERROR)
+    socketio.emit('batch_complete', {
+        'batch_id': batch_id,
+        'finished': finished,
+        'failed': failed,
+        'download_url': f"/batch/{batch_id}/zip",
+    }, to=batch_id)
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Download many videos at once.
+
+    Takes ``urls`` (a list) and/or ``url`` (a playlist, expanded with a flat
+    extraction), plus ``format``/``formats``, ``quality`` and ``sid``. Progress
+    arrives as ``batch_progress`` events and the files as /batch/<id>/zip.
+    """
+    urls = list(request.json.get('urls') or [])
+    playlist_url = request.json.get('url')
+    format_type = request.json.get('format')
+    quality = request.json.get('quality', 'best')
+    sid = request.json.get('sid')
+    formats = list(dict.fromkeys(request.json.get('formats') or [format_type]))
+
+    if not formats or any(fmt not in DOWNLOAD_FORMATS for fmt in formats):
+        return jsonify({'success': False, 'error': 'Invalid format'}), 400
+    # Items are not limited one by one: a batch holds at most BATCH_CONCURRENCY of them
+    # in the queue, and backs off by itself while the queue is full
+    rejected = throttle(admit=True)
+    if rejected:
+        return rejected
+    if playlist_url:
+        try:
+            logging.info(f"Expanding playlist: {playlist_url}")
+            urls += executor.run_in_process(
+                expand_playlist, playlist_url, extraction_opts(), EXTRACT_TIMEOUT,
+                timeout=EXTRACT_TIMEOUT, stage='extract', pool=YT_DLP,
+            )
+        except Exception as e:
+            logging.error(f"Error expanding playlist {playlist_url}: {str(e)}")
+            return jsonify({'success': False, 'error': str(e)}), 502
+    urls = list(dict.fromkeys(url for url in urls if url))
+    if not urls:
+        return jsonify({'success': False, 'error': 'URL is required'}), 400
+    if len(urls) > MAX_BATCH_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {MAX_BATCH_ITEMS} items per batch'}), 400
+
+    batch_id = uuid.uuid4().hex
+    items = [
+        {'url': url, 'job_id': None, 'status': jobs.QUEUED, 'error': None, 'filename': None, 'outputs': {}, 'progress': 0}
+        for url in urls
+    ]
+    batch_store.create(
+        batch_id, formats=formats, quality=quality, total=len(items), items=[dict(item) for item in items],
+        owner=WORKER_ID,
+    )
+    subscribe_to_job(sid, batch_id)
+    socketio.start_background_task(run_batch, batch_id, items, formats, quality)
+    logging.info(f"Started batch {batch_id} with {len(items)} items")
+    return jsonify({'success': True, 'batch_id': batch_id, 'total': len(items)})
+
+
+@app.route('/batch/<batch_id>')
+def batch_status(batch_id):
+    """Current status of a batch and each of its items."""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return jsonify({'success': False, 'error': 'Unknown batch'}), 404
+    record['download_url'] = f"/batch/{batch_id}/zip"
+    return jsonify({'success': True, 'batch': record})
+
+
+@app.route('/batch/<batch_id>/zip')
+def batch_zip(batch_id):
+    """The batch's finished files as one ZIP, streamed as it is built (no copy on disk)."""
+    record = batch_store.get(batch_id)
+    if record is None:
+        return "Unknown batch.", 404
+    filenames = list(dict.fromkeys(
+        filename for item in record['items'] for filename in (item['outputs'] or {}).values()
+    ))
+    if not filenames:
+        return "No finished files in this batch.", 404
+
+    # Keep the janitor away from the files until the archive has been sent
+    for filename in filenames:
+        storage.pin(filename)
+
+    def unpin_all():
+        for filename in filenames:
+            storage.unpin(filename)
+            storage.touch(filename)
+
+    logging.info(f"Streaming ZIP of {len(filenames)} files for batch {batch_id}")
+    response = Response(
+        stream_zip(OUTPUT_DIR, filenames),
+        mimetype='application/zip',
+        headers={'Content-Disposition': content_disposition_header(f'batch-{batch_id}.zip')},
+    )
+    response.call_on_close(unpin_all)
+    return response
+
+
+def take_over(store, record):
+    """Claim an unfinished job or batch whose owner's lease ran out; False if it is still owned."""
+    owner = record.get('owner')
+    if owner == WORKER_ID or time.time() - record['updated'] < JOB_LEASE_SECONDS:
+        return False
+    # Conditional on the record being unchanged, so only one worker wins and a late renewal keeps it
+    return store.update(record['id'], expect={'owner': owner, 'updated': record['updated']}, owner=WORKER_ID) is not None
+
+
+def renew_lease(store, timeout):
+    """Renew the leases on this worker's unfinished records in ``store``; returns their IDs."""
+    if isinstance(store, jobs.SQLiteJobStore):
+        # A busy database would stall the hub for up to its busy timeout
+        return executor.run(store.renew, WORKER_ID, timeout=timeout, stage='lease renewal')
+    return store.renew(WORKER_ID)
+
+
+def renew_leases():
+    """Keep the leases on this worker's unfinished jobs and batches, and the output claims of the jobs.
+
+    Runs forever, every quarter of JOB_LEASE_SECONDS. Meant for a background task.
+    """
+    interval = JOB_LEASE_SECONDS / 4
+    while True:
+        socketio.sleep(interval)
+        try:
+            job_ids = renew_lease(job_store, interval)
+            # However long a job queues, fetches and postprocesses, its claims last as long as it runs
+            if job_ids:
+                executor.run(output_cache.renew_claims, job_ids, timeout=interval, stage='lease renewal')
+        except Exception as e:
+            logging.error(f"Error renewing job leases: {str(e)}")
+        try:
+            renew_lease(batch_store, interval)
+        except Exception as e:
+            logging.error(f"Error renewing batch leases: {str(e)}")
+
+
+def take_over_expired_leases():
+    """Resume unfinished jobs and batches whose lease ran out, every third of JOB_LEASE_SECONDS.
+
+    Runs forever, separately from renew_leases so that resuming jobs never delays a renewal.
+    Meant for a background task.
+    """
+    while True:
+        socketio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            resume_interrupted_jobs()
+        except Exception as e:
+            logging.error(f"Error taking over interrupted jobs: {str(e)}")
+
+
+def resume_interrupted_jobs():
+    """Run jobs (and batches) again whose worker went away (restart, deploy, OOM) and left its lease to run out.
+
+    A resumed job keeps its ID and work directory, so yt-dlp continues from
+    the .part files and fragment state already on disk instead of starting
+    over, and clients that re-subscribe to the job get its events.
+    """
+    for job in job_store.unfinished():
+        if not take_over(job_store, job):
+            continue
+        job_id = job['id']
+        logging.info(f"Resuming interrupted job {job_id} ({job['url']}), last stage: {job['status']}")
+        try:
+            result, _ = start_download(
+                job['url'], job.get('formats') or [job['format']], job['quality'],
+                job_id=job_id, created=job['created'], resumed=job.get('resumed', 0) + 1,
+            )
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        if not result.get('success'):
+            job_store.update(job_id, status=jobs.ERROR, error=result.get('error'))
+            socketio.emit('download_error', {'job_id': job_id, 'error': result.get('error')}, to=job_id)
+        elif result['job_id'] != job_id:
+            # Another job is producing the same output by now
+            error = f"Continued as job {result['job_id']}"
+            job_store.update(job_id, status=jobs.ERROR, error=error)
+            socketio.emit('download_error', {'job_id': job_id, 'error': error}, to=job_id)
+
+    for record in batch_store.unfinished():
+        if take_over(batch_store, record):
+            logging.info(f"Resuming interrupted batch {record['id']}")
+            socketio.start_background_task(run_batch, record['id'], record['items'], record['formats'], record['quality'])
+
+
+def warm_up_yt_dlp():
+    """Start the yt-dlp worker processes, which import yt-dlp and build the common YoutubeDL instances.
+
+    The app answers requests before this finishes; a download that starts
+    earlier waits for its worker to get there.
+    """
+    started = time.monotonic()
+    outcomes = executor.map_in_process(worker_stats, [()] * YTDLP_PROCESSES, stage='warm-up', pool=YT_DLP)
+    for stats, error in outcomes:
+        if error is not None:
+            logging.warning(f"Could not warm up yt-dlp: {str(error)}")
+            return
+    by_process = {stats['pid']: stats for stats, _ in outcomes}
+    logging.info(f"yt-dlp warmed up in {time.monotonic() - started:.2f}s: {list(by_process.values())}")
+
+
+# --- STARTUP ---
+# Spawned worker processes import this module as __mp_main__ when the app is
+# started with "python app.py"; they must not resume jobs or sweep storage.
+if __name__ != '__mp_main__':
+    # Resumed jobs pin their work directories before the janitor's first sweep
+    resume_interrupted_jobs()
+    socketio.start_background_task(storage.run_janitor, JANITOR_INTERVAL, socketio.sleep)
+    socketio.start_background_task(renew_leases)
+    socketio.start_background_task(take_over_expired_leases)
+    if YDL_POOL_WARM:
+        socketio.start_background_task(warm_up_yt_dlp)
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     # Use '0.0.0.0' to be accessible externally
@@ -0,0 +1,30 @@
+# Stub extractor for benchmark.py. Only loaded by app processes that have
+# bench/ on PYTHONPATH (benchmark.py starts the app that way), never in production.
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchFixtureIE(InfoExtractor):
+    """Videos served by benchmark.py's fixture server.
+
+    The server answers /bench/info/<id> with the formats of the requested
+    fixture (after an artificial extraction delay), so extraction costs one
+    local HTTP request instead of a trip to YouTube.
+    """
+    IE_NAME = 'benchfixture'
+    _VALID_URL = r'(?P<base>https?://(?:127\.0\.0\.1|localhost)(?::\d+)?)/bench/watch\?v=(?P<id>[\w-]+)(?:&kind=(?P<kind>[\w-]+))?'
+
+    def _real_extract(self, url):
+        base, video_id, kind = self._match_valid_url(url).group('base', 'id', 'kind')
+        info = self._download_json(
+            f'{base}/bench/info/{video_id}', video_id, query={'kind': kind or 'audio'},
+            note='Downloading fixture info',
+        )
+        formats = info.pop('formats')
+        for fmt in formats:
+            fmt['url'] = base + fmt['url']
+        return {
+            'id': video_id,
+            'title': f'Bench fixture {video_id}',
+            'formats': formats,
+            **info,
+        }
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark and load test: no YouTube, no network access needed.
+
+Starts a local fixture server with generated media (progressive and HLS,
+audio and, when ffmpeg can make it, video), starts the app with the stub
+extractor in bench/ on its PYTHONPATH, and drives /get_download_url,
+/download, Socket.IO and /download_file at increasing concurrency.
+
+For every level it reports throughput, p50/p99 latencies, time to first
+progress event and peak RSS/disk of the app. Save a run with --json and
+pass it as --baseline to a later run to compare before and after a change:
+
+    python3 benchmark.py --json before.json
+    # ... change something ...
+    python3 benchmark.py --baseline before.json
+
+Besides the app's requirements it needs the Socket.IO client and requests
+(websocket-client is optional, without it Socket.IO falls back to polling):
+
+    pip install -r requirements-bench.txt
+"""
+
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import requests
+import socketio
+
+try:
+    import websocket  # noqa: F401 (lets the Socket.IO client use WebSocket like the browser does)
+    SOCKETIO_TRANSPORTS = None
+except ImportError:
+    SOCKETIO_TRANSPORTS = ['polling']
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Holds yt_dlp_plugins/extractor/benchfixture.py
+PLUGIN_DIR = os.path.join(REPO_DIR, 'bench')
+
+SAMPLE_RATE = 44100
+HLS_SEGMENT_SECONDS = 2
+AUDIO_CODECS = {'acodec': 'pcm_s16le', 'vcodec': 'none'}
+VIDEO_CODECS = {'vcodec': 'avc1.64001e', 'acodec': 'mp4a.40.2', 'width': 640, 'height': 360}
+
+
+# --- FIXTURES ---
+
+def write_tone(path, seconds):
+    """A mono 16-bit sine tone as WAV; needs nothing but the standard library."""
+    period = SAMPLE_RATE // 441
+    cycle = b''.join(
+        int(12000 * math.sin(2 * math.pi * i / period)).to_bytes(2, 'little', signed=True) for i in range(period)
+    )
+    frames = SAMPLE_RATE * seconds
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(cycle * (frames // period))
+
+
+def split_for_hls(path, directory, segments):
+    """HLS playlist over byte slices of ``path``; yt-dlp's native HLS downloader joins them back."""
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = math.ceil(len(data) / segments)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{HLS_SEGMENT_SECONDS}', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(segments):
+        with open(os.path.join(directory, f'seg{i}.bin'), 'wb') as f:
+            f.write(data[i * size:(i + 1) * size])
+        lines += [f'#EXTINF:{HLS_SEGMENT_SECONDS}.0,', f'seg{i}.bin']
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(directory, 'index.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def make_video(directory, seconds):
+    """H.264/AAC MP4 and an HLS rendition of it, if ffmpeg can encode them. Returns success."""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    mp4 = os.path.join(directory, 'video.mp4')
+    hls = os.path.join(directory, 'hls-video')
+    os.makedirs(hls, exist_ok=True)
+    commands = [
+        [ffmpeg, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'testsrc=size=640x360:rate=25:duration={seconds}',
+         '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+         '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', mp4],
+        [ffmpeg, '-y', '-loglevel', 'error', '-i', mp4, '-c', 'copy', '-f', 'hls',
+         '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+         '-hls_segment_filename', os.path.join(hls, 'seg%d.ts'), os.path.join(hls, 'index.m3u8')],
+    ]
+    for command in commands:
+        if subprocess.run(command, capture_output=True).returncode != 0:
+            return False
+    return True
+
+
+def make_fixtures(directory, seconds):
+    """Generate the media and return the formats of each fixture kind."""
+    tone = os.path.join(directory, 'tone.wav')
+    write_tone(tone, seconds)
+    split_for_hls(tone, os.path.join(directory, 'hls-audio'), max(1, seconds // HLS_SEGMENT_SECONDS))
+    kinds = {
+        'audio': [{'format_id': 'wav', 'url': '/media/tone.wav', 'ext': 'wav', 'protocol': 'http',
+                   'filesize': os.path.getsize(tone), **AUDIO_CODECS}],
+        'hls-audio': [{'format_id': 'hls-wav', 'url': '/media/hls-audio/index.m3u8', 'ext': 'wav',
+                       'protocol': 'm3u8_native', **AUDIO_CODECS}],
+    }
+    if make_video(directory, seconds):
+        kinds['video'] = [{'format_id': '360p', 'url': '/media/video.mp4', 'ext': 'mp4', 'protocol': 'http',
+                           'filesize': os.path.getsize(os.path.join(directory, 'video.mp4')), **VIDEO_CODECS}]
+        kinds['hls-video'] = [{'format_id': 'hls-360p', 'url': '/media/hls-video/index.m3u8', 'ext': 'mp4',
+                               'protocol': 'm3u8_native', **VIDEO_CODECS}]
+    return kinds
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/bench/info/'):
+            kind = parse_qs(url.query).get('kind', ['audio'])[0]
+            formats = self.server.kinds.get(kind)
+            if formats is None:
+                return self._send(404, b'unknown fixture kind', 'text/plain')
+            # Stands in for the round trips of a real extraction
+            time.sleep(self.server.extract_delay)
+            info = {'formats': formats, 'duration': self.server.seconds}
+            return self._send(200, json.dumps(info).encode(), 'application/json')
+        if url.path.startswith('/media/'):
+            path = os.path.realpath(os.path.join(self.server.directory, url.path[len('/media/'):]))
+            if not path.startswith(self.server.directory + os.sep) or not os.path.isfile(path):
+                return self._send(404, b'not found', 'text/plain')
+            if path.endswith(('.bin', '.ts')):
+                time.sleep(self.server.segment_delay)
+            with open(path, 'rb') as f:
+                data = f.read()
+            return self._send_media(data)
+        self._send(404, b'not found', 'text/plain')
+
+    def _send_media(self, data):
+        start, end, status, extra = 0, len(data) - 1, 200, {}
+        if self.headers.get('Range'):
+            first, _, last = self.headers['Range'].split('=', 1)[1].partition('-')
+            start, end = int(first), min(int(last) if last else end, end)
+            status, extra = 206, {'Content-Range': f'bytes {start}-{end}/{len(data)}'}
+        self._send(status, data[start:end + 1], 'application/octet-stream', extra)
+
+    def _send(self, status, data, content_type, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(data)
+            return
+        # Per-connection throttle, in 64 KiB steps
+        step = 64 * 1024
+        for offset in range(0, len(data), step):
+            self.wfile.write(data[offset:offset + step])
+            time.sleep(step / bandwidth)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients dropping connections are expected
+
+
+def start_fixture_server(directory, kinds, args):
+    server = FixtureServer(('127.0.0.1', 0), FixtureHandler)
+    server.directory = os.path.realpath(directory)
+    server.kinds = kinds
+    server.seconds = args.seconds
+    server.extract_delay = args.extract_delay
+    server.segment_delay = args.segment_delay
+    server.bandwidth = args.bandwidth
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- APP UNDER TEST ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(server, port, work_dir, log, source_dir=REPO_DIR):
+    """Run the app in ``source_dir`` from ``work_dir`` (so OUTPUT_DIR and the caches start empty) with the stub extractor."""
+    env = {
+        **os.environ,
+        'PORT': str(port),
+        'FLASK_DEBUG': 'false',
+        'PYTHONPATH': os.pathsep.join(filter(None, [PLUGIN_DIR, source_dir, os.environ.get('PYTHONPATH')])),
+        # The load generator is one client hammering the app on purpose
+        'CLIENT_RATE_LIMIT': '0',
+        'VIDEO_RATE_LIMIT': '0',
+        'ADMISSION_MAX_LOAD': '0',
+    }
+    if server == 'gunicorn':
+        # The production setup from render.yaml
+        command = [sys.executable, '-m', 'gunicorn', '--worker-class', 'eventlet', '-w', '1',
+                   '--bind', f'127.0.0.1:{port}', 'app:app']
+    else:
+        command = [sys.executable, os.path.join(source_dir, 'app.py')]
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited during startup (status {process.returncode}), see {log.name}")
+        try:
+            # The page itself: every version of the app serves it, unlike /stats
+            if requests.get(url + '/', timeout=2).ok:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"App did not start within 60s, see {log.name}")
+
+
+def process_tree_rss(pid):
+    """Resident memory of ``pid`` and all its descendants (ffmpeg workers included), in bytes. Linux only."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, pending = 0, [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+        pending += children.get(current, [])
+    return total
+
+
+def disk_usage(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResourceSampler:
+    """Samples the app's peak RSS and OUTPUT_DIR size in a background thread."""
+
+    def __init__(self, pid, directory, interval=0.2):
+        self.pid = pid
+        self.directory = directory
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, process_tree_rss(self.pid))
+            self.peak_disk = max(self.peak_disk, disk_usage(self.directory))
+            self._stop.wait(self.interval)
+
+
+# --- LOAD GENERATOR ---
+
+def run_one(app_url, video_url, formats, timeout):
+    """One user: connect Socket.IO, /get_download_url, /download, wait for the events, fetch the file.
+
+    Also works against versions of the app from before jobs had IDs (and the
+    baseline app, which only produces ``formats[0]``): their events are
+    broadcast without a job ID, so they are matched by the file name, which
+    starts with the fixture's title.
+    """
+    sample = {'ok': False, 'error': None, 'rejected': False}
+    title = f"Bench fixture {parse_qs(urlparse(video_url).query)['v'][0]}"
+    job = {}
+    # Events as they arrive: ours can come before /download has returned the job ID
+    progress = []
+    outcomes = []
+    lost = []
+    arrived = threading.Condition()
+    sio = socketio.Client(reconnection=False)
+
+    def ours(data):
+        if 'job_id' in data or job.get('job_id'):
+            return data.get('job_id') == job.get('job_id')
+        filename = os.path.basename(data.get('filename') or '')
+        # Errors without a file name could be anyone's; the run fails either way
+        return not filename or filename.startswith((f'{title}.', f'{title} '))
+
+    @sio.on('download_progress')
+    def on_progress(data):
+        progress.append((time.monotonic(), data))
+
+    def on_outcome(data):
+        with arrived:
+            outcomes.append(data)
+            arrived.notify_all()
+
+    sio.on('download_complete', on_outcome)
+    sio.on('download_error', lambda data: on_outcome({**data, 'success': False}))
+
+    @sio.on('disconnect')
+    def on_disconnect(*reason):
+        # The job's events would never arrive, so give up on it straight away
+        with arrived:
+            lost.append(time.monotonic())
+            arrived.notify_all()
+
+    session = requests.Session()
+    started = time.monotonic()
+    try:
+        sio.connect(app_url, transports=SOCKETIO_TRANSPORTS, wait_timeout=10)
+        sample['connect'] = time.monotonic() - started
+
+        t = time.monotonic()
+        info = session.post(app_url + '/get_download_url', json={'url': video_url, 'format': formats[0]}, timeout=timeout)
+        sample['get_download_url'] = time.monotonic() - t
+        info = info.json()
+        if not info.get('success'):
+            raise RuntimeError(f"/get_download_url: {info.get('error')}")
+
+        submitted = time.monotonic()
+        response = session.post(app_url + '/download', json={
+            'url': video_url, 'format': formats[0], 'formats': formats,
+            'info_handle': info.get('info_handle'), 'sid': sio.get_sid(),
+        }, timeout=timeout)
+        sample['download'] = time.monotonic() - submitted
+        if response.status_code == 429:
+            sample['rejected'] = True
+            raise RuntimeError('rejected with 429')
+        job.update(response.json())
+        if not job.get('success'):
+            raise RuntimeError(f"/download: {job.get('error')}")
+
+        with arrived:
+            if not arrived.wait_for(lambda: lost or any(ours(data) for data in outcomes), timeout):
+                raise RuntimeError(f"job {job.get('job_id', title)} did not finish within {timeout}s")
+            outcome = next((data for data in outcomes if ours(data)), None)
+        if outcome is None:
+            raise RuntimeError('Socket.IO connection lost before the job finished')
+        completed = time.monotonic()
+        if not outcome.get('success'):
+            raise RuntimeError(f"job failed: {outcome.get('error')}")
+        first_progress = [at for at, data in list(progress) if ours(data)]
+        if first_progress:
+            sample['first_progress'] = first_progress[0] - submitted
+        sample['job'] = completed - submitted
+
+        t = time.monotonic()
+        if job.get('job_id'):
+            file_url = f"{app_url}/download_file/{job['job_id']}"
+        else:
+            file_url = f"{app_url}/download_file/{quote(outcome['filename'])}"
+        with session.get(file_url, stream=True, timeout=timeout) as served:
+            served.raise_for_status()
+            sample['bytes'] = sum(len(chunk) for chunk in served.iter_content(256 * 1024))
+        sample['serve'] = time.monotonic() - t
+        sample['total'] = time.monotonic() - started
+        sample['ok'] = True
+    except Exception as e:
+        sample['error'] = str(e)
+    finally:
+        session.close()
+        if sio.connected:
+            sio.disconnect()
+    return sample
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(samples, wall, sampler):
+    ok = [s for s in samples if s['ok']]
+    summary = {
+        'requests': len(samples),
+        'completed': len(ok),
+        'failed': len(samples) - len(ok),
+        'rejected': sum(1 for s in samples if s['rejected']),
+        'throughput': round(len(ok) / wall, 3) if wall else 0,
+        'wall_seconds': round(wall, 3),
+        'peak_rss_mib': round(sampler.peak_rss / 1024 ** 2, 1),
+        'peak_disk_mib': round(sampler.peak_disk / 1024 ** 2, 1),
+        'errors': sorted({s['error'] for s in samples if s['error']})[:5],
+    }
+    for key in ('get_download_url', 'download', 'first_progress', 'job', 'serve', 'total'):
+        values = [s[key] for s in ok if key in s]
+        summary[key] = {
+            'p50': round(percentile(values, 0.5), 3) if values else None,
+            'p99': round(percentile(values, 0.99), 3) if values else None,
+        }
+    return summary
+
+
+def run_level(app, fixture_url, kind, formats, concurrency, args, run_id):
+    process, app_url, output_dir = app
+    count = concurrency * args.requests_per_client
+    # Every request gets its own video ID, so nothing is answered from the caches
+    urls = [f'{fixture_url}/bench/watch?v={run_id}-{kind}-c{concurrency}-{i}&kind={kind}' for i in range(count)]
+    with ResourceSampler(process.pid, output_dir) as sampler:
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            samples = list(pool.map(lambda url: run_one(app_url, url, formats, args.timeout), urls))
+        wall = time.monotonic() - started
+    return summarize(samples, wall, sampler)
+
+
+# --- REPORT ---
+
+def fmt_seconds(value):
+    return '-' if value is None else f'{value:.3f}'
+
+
+def print_report(results, baseline=None):
+    header = (
+        f"{'scenario':<16} {'conc':>4} {'ok/req':>7} {'jobs/s':>7} {'total p50':>9} {'total p99':>9} "
+        f"{'1st prog p50':>12} {'info p50':>8} {'serve p50':>9} {'rss MiB':>8} {'disk MiB':>8}"
+    )
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(
+            f"{result['scenario']:<16} {result['concurrency']:>4} "
+            f"{str(result['completed']) + '/' + str(result['requests']):>7} {result['throughput']:>7.2f} "
+            f"{fmt_seconds(result['total']['p50']):>9} {fmt_seconds(result['total']['p99']):>9} "
+            f"{fmt_seconds(result['first_progress']['p50']):>12} {fmt_seconds(result['get_download_url']['p50']):>8} "
+            f"{fmt_seconds(result['serve']['p50']):>9} {result['peak_rss_mib']:>8.1f} {result['peak_disk_mib']:>8.1f}"
+        )
+        for error in result['errors']:
+            print(f"    error: {error}")
+
+    if not baseline:
+        return
+    print()
+    print("Compared with baseline (negative latency / positive throughput change is better):")
+    before = {(r['scenario'], r['concurrency']): r for r in baseline}
+    for result in results:
+        old = before.get((result['scenario'], result['concurrency']))
+        if old is None:
+            continue
+        changes = [('jobs/s', old['throughput'], result['throughput'])]
+        changes += [
+            (f'{key} {stat}', old[key][stat], result[key][stat])
+            for key in ('total', 'first_progress') for stat in ('p50', 'p99')
+        ]
+        changes.append(('rss MiB', old['peak_rss_mib'], result['peak_rss_mib']))
+        text = ', '.join(
+            f"{name} {(new - prev) / prev * 100:+.1f}%" for name, prev, new in changes if prev and new is not None
+        )
+        print(f"  {result['scenario']:<16} c={result['concurrency']:<4} {text}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append',
+                        help="kind:formats, e.g. audio:mp3, hls-audio:mp3,wav or hls-video:mp4 (repeatable; "
+                             "default audio:mp3 and hls-audio:mp3, plus video:mp4 and hls-video:mp4 when ffmpeg "
+                             "can generate video fixtures)")
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels (default 1,4,16)')
+    parser.add_argument('--requests-per-client', type=int, default=2, help='requests per concurrent client per level')
+    parser.add_argument('--seconds', type=int, default=30, help='length of the generated media')
+    parser.add_argument('--extract-delay', type=float, default=0.2, help='simulated extraction latency, seconds')
+    parser.add_argument('--segment-delay', type=float, default=0.02, help='simulated latency per HLS segment, seconds')
+    parser.add_argument('--bandwidth', type=int, default=0, help='per-connection bytes/s from the fixture server (0: unlimited)')
+    parser.add_argument('--server', choices=('dev', 'gunicorn'), default='dev',
+                        help='run the app with python app.py, or under gunicorn with the eventlet worker like '
+                             'render.yaml (needs a gunicorn release that still ships that worker)')
+    parser.add_argument('--timeout', type=float, default=300, help='per-request timeout, seconds')
+    parser.add_argument('--source', default=REPO_DIR,
+                        help='directory with the app.py to run (default: this checkout), e.g. a git worktree '
+                             'of an older commit to measure it with this benchmark')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    levels = [int(level) for level in args.concurrency.split(',') if level]
+    work_dir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    fixture_dir = os.path.join(work_dir, 'fixtures')
+    app_dir = os.path.join(work_dir, 'app')
+    os.makedirs(fixture_dir)
+    os.makedirs(app_dir)
+    log = open(os.path.join(work_dir, 'app.log'), 'w')
+    process = None
+    try:
+        print(f"Generating {args.seconds}s fixtures in {fixture_dir}...")
+        kinds = make_fixtures(fixture_dir, args.seconds)
+        if 'video' not in kinds:
+            print("ffmpeg could not generate video fixtures, video scenarios are skipped")
+        scenarios = args.scenario or ['audio:mp3', 'hls-audio:mp3'] + (
+            ['video:mp4', 'hls-video:mp4'] if 'video' in kinds else []
+        )
+        fixtures = start_fixture_server(fixture_dir, kinds, args)
+        fixture_url = f'http://127.0.0.1:{fixtures.server_port}'
+
+        process, app_url = start_app(args.server, free_port(), app_dir, log, args.source)
+        app = (process, app_url, os.path.join(app_dir, 'temp_downloads'))
+        print(f"App running at {app_url} ({args.server}), log in {log.name}")
+
+        run_id = uuid.uuid4().hex[:6]
+        results = []
+        for scenario in scenarios:
+            kind, _, formats = scenario.partition(':')
+            if kind not in kinds:
+                print(f"Skipping {scenario}: no '{kind}' fixture")
+                continue
+            formats = formats.split(',') if formats else ['mp3']
+            for concurrency in levels:
+                print(f"Running {scenario} at concurrency {concurrency}...")
+                result = run_level(app, fixture_url, kind, formats, concurrency, args, run_id)
+                results.append({'scenario': scenario, 'concurrency': concurrency, **result})
+
+        print()
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        print_report(results, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'args': vars(args), 'results': results}, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(work_dir, 'app'), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
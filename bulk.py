@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Headless bulk downloader: runs a list of URLs through the same pipeline as
+the web app, without Flask or Socket.IO, in a pool of worker processes.
+
+URLs are read one per line from a file, or from stdin when no file (or "-")
+is given; blank lines and lines starting with # are skipped. Outputs land in
+the app's output directory and go through its metadata and output caches,
+so anything the app (or an earlier run) already produced is skipped.
+
+A JSON summary with per-item status, files and timings is printed to stdout
+(or written to --summary); progress and logs go to stderr.
+
+    python3 bulk.py urls.txt --format mp3 --workers 4 > summary.json
+    yt-dlp --flat-playlist --print url PLAYLIST | python3 bulk.py --format mp4 --quality 720p
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+import pipeline
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def read_urls(source):
+    """URLs from ``source`` (a path, or "-" for stdin), without blanks, comments and duplicates."""
+    stream = sys.stdin if source in (None, '-') else open(source, encoding='utf-8')
+    try:
+        lines = [line.strip() for line in stream]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+
+
+def _init_worker(output_dir, postprocess_timeout):
+    pipeline.init_worker(
+        pool_hosts=int(os.environ.get('HTTP_POOL_HOSTS', 10)),
+        pool_size=int(os.environ.get('HTTP_POOL_SIZE', 32)),
+    )
+    _worker.update(
+        output_dir=output_dir,
+        postprocess_timeout=postprocess_timeout,
+        metadata_cache=pipeline.make_metadata_cache(),
+        output_cache=pipeline.make_output_cache(output_dir),
+    )
+
+
+def _download(url, formats, quality):
+    """Pool entry point: one URL, start to finish, in this worker process."""
+    work_dir = os.path.join(_worker['output_dir'], '.work', f'bulk-{uuid.uuid4().hex}')
+    return pipeline.run_download(
+        url, formats, quality, _worker['output_dir'], work_dir,
+        _worker['metadata_cache'], _worker['output_cache'],
+        postprocess_timeout=_worker['postprocess_timeout'],
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('urls', nargs='?', default='-', help='file with one URL per line (default: stdin)')
+    parser.add_argument('--format', dest='formats', action='append', choices=pipeline.DOWNLOAD_FORMATS,
+                        help='output format, repeat for several from one fetch (default: mp3)')
+    parser.add_argument('--quality', default='best', choices=sorted(pipeline.MP4_QUALITY_MAP),
+                        help='MP4 quality (default: best)')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 2),
+                        help='worker processes, each running one download at a time')
+    parser.add_argument('--output-dir', default=os.path.join(os.getcwd(), 'temp_downloads'),
+                        help="where files go (default: the web app's temp_downloads/, sharing its output cache)")
+    parser.add_argument('--expand-playlists', action='store_true',
+                        help='replace playlist URLs with their entries before downloading')
+    parser.add_argument('--postprocess-timeout', type=int, default=int(os.environ.get('POSTPROCESS_TIMEOUT', 1800)),
+                        help='seconds allowed for ffmpeg per output')
+    parser.add_argument('--summary', help='write the JSON summary to this file instead of stdout')
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    formats = list(dict.fromkeys(args.formats or ['mp3']))
+    urls = read_urls(args.urls)
+    if args.expand_playlists:
+        expanded = []
+        for url in urls:
+            try:
+                expanded += pipeline.expand_playlist(url, pipeline.extraction_opts())
+            except Exception as e:
+                logging.error(f"Could not expand {url}: {str(e)}")
+                expanded.append(url)
+        urls = list(dict.fromkeys(expanded))
+    os.makedirs(os.path.join(args.output_dir, '.work'), exist_ok=True)
+    logging.info(f"Downloading {len(urls)} URL(s) as {', '.join(formats).upper()} with {args.workers} worker(s)")
+
+    started = time.time()
+    items = [None] * len(urls)
+    # Spawned workers start clean, like the app's ffmpeg pool
+    with concurrent.futures.ProcessPoolExecutor(
+        args.workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(args.output_dir, args.postprocess_timeout),
+    ) as pool:
+        futures = {pool.submit(_download, url, formats, args.quality): index for index, url in enumerate(urls)}
+        try:
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    item = future.result()
+                except Exception as e:  # a worker process died
+                    item = {'url': urls[index], 'formats': formats, 'quality': args.quality, 'status': 'error',
+                            'error': str(e), 'outputs': {}, 'errors': {}, 'timings': {}, 'bytes': {},
+                            'ffmpeg_cpu_seconds': {}}
+                items[index] = item
+                logging.info(
+                    f"[{done}/{len(urls)}] {item['status']}: {item['url']} ({item['timings'].get('total', 0)}s)"
+                )
+        except KeyboardInterrupt:
+            logging.warning("Interrupted, cancelling the remaining downloads")
+            pool.shutdown(cancel_futures=True)
+    items = [
+        item or {'url': url, 'status': 'cancelled', 'outputs': {}, 'timings': {}} for url, item in zip(urls, items)
+    ]
+
+    counts = {}
+    for item in items:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    summary = {
+        'started': started,
+        'wall_seconds': round(time.time() - started, 3),
+        'workers': args.workers,
+        'formats': formats,
+        'quality': args.quality,
+        'output_dir': args.output_dir,
+        'counts': counts,
+        'items': items,
+    }
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    logging.info(f"Finished in {summary['wall_seconds']}s: {counts}")
+    return 1 if counts.get('error') or counts.get('cancelled') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import concurrent.futures
+import contextlib
+import math
+import multiprocessing
+import signal
+import subprocess
+import threading
+import time
+
+# Process pools of a BlockingExecutor
+FFMPEG = 'ffmpeg'
+YT_DLP = 'yt-dlp'
+
+
+class StageTimeout(Exception):
+    """Raised when a pipeline stage runs longer than its timeout."""
+
+
+# Ends (time.monotonic()) of the deadlines active in this process, innermost last
+_deadlines = []
+
+
+@contextlib.contextmanager
+def deadline(timeout, stage):
+    """Raise StageTimeout inside the ``with`` block once ``timeout`` seconds have passed (none if falsy).
+
+    Uses SIGALRM, so it only works in a process's main thread, which is
+    where pool workers run their tasks. Libraries may catch the timeout and
+    raise their own error instead; any error leaving the block after the
+    deadline is reported as the timeout.
+    """
+    if not timeout:
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise StageTimeout(f"{stage} timed out after {timeout}s")
+
+    end = time.monotonic() + timeout
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.alarm(max(1, math.ceil(timeout)))
+    _deadlines.append(end)
+    try:
+        yield
+    except StageTimeout:
+        raise
+    except Exception as e:
+        if time.monotonic() >= end:
+            raise StageTimeout(f"{stage} timed out after {timeout}s") from e
+        raise
+    finally:
+        _deadlines.pop()
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def deadline_passed():
+    """Whether the innermost ``deadline`` of this process has passed, for code running in other threads."""
+    return bool(_deadlines) and time.monotonic() >= _deadlines[-1]
+
+
+def hub_event(async_mode):
+    """The Event class for code on the Socket.IO event loop to wait on.
+
+    Under eventlet a real threading.Event (threading not monkey patched, as
+    with "python app.py") would block the hub, and with it whoever is
+    supposed to set the event; the green one only suspends the caller.
+    """
+    if async_mode == 'eventlet':
+        from eventlet.green.threading import Event
+        return Event
+    return threading.Event
+
+
+def hub_popen(async_mode):
+    """The Popen class for code on the Socket.IO event loop that reads a child's output.
+
+    Under eventlet, reading a real pipe blocks the hub (with or without
+    monkey patching) until the child writes; green pipes only suspend the reader.
+    """
+    if async_mode == 'eventlet':
+        from eventlet.green.subprocess import Popen
+        return Popen
+    return subprocess.Popen
+
+
+class BlockingExecutor:
+    """Runs blocking work away from the Socket.IO event loop.
+
+    Work goes to pools of separate processes, spawned so they start without
+    eventlet's monkey patching: yt-dlp (extraction and downloads) in the
+    YT_DLP pool, whose processes are set up by ``yt_dlp_initializer``, and
+    ffmpeg postprocessing in the FFMPEG pool. yt-dlp must not run in native
+    threads of a monkey patched process, where its sockets and locks are
+    green and break as soon as two threads use them.
+
+    Under eventlet without monkey patching, waiting for a process blocks a
+    native thread (``tpool``, ``threads`` of them) rather than the hub.
+    """
+
+    def __init__(self, async_mode, threads=8, processes=2, yt_dlp_processes=4, yt_dlp_initializer=None):
+        self.use_tpool = async_mode == 'eventlet'
+        self.processes = {FFMPEG: processes, YT_DLP: yt_dlp_processes}
+        self._initializers = {YT_DLP: yt_dlp_initializer}
+        self._process_pools = {}
+        self._process_pool_lock = threading.Lock()
+        if self.use_tpool:
+            from eventlet import tpool
+            tpool.set_num_threads(threads)
+            self._threads = None
+        else:
+            self._threads = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='blocking')
+
+    def run(self, fn, *args, timeout=None, stage='task'):
+        """Call ``fn(*args)`` in a native thread and return its result.
+
+        Raises StageTimeout after ``timeout`` seconds. The thread itself cannot
+        be interrupted; callers that can, should make ``fn`` stop cooperatively.
+        """
+        if self.use_tpool:
+            import eventlet
+            from eventlet import tpool
+            try:
+                with eventlet.Timeout(timeout):
+                    return tpool.execute(fn, *args)
+            except eventlet.Timeout:
+                raise StageTimeout(f"{stage} timed out after {timeout}s")
+
+        future = self._threads.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise StageTimeout(f"{stage} timed out after {timeout}s")
+
+    def run_in_process(self, fn, *args, timeout=None, stage='task', pool=FFMPEG):
+        """Call ``fn(*args)`` in the process pool ``pool`` and return its result.
+
+        ``fn`` and its arguments must be picklable. The worker process is
+        expected to enforce ``timeout`` itself (see ``deadline``); the wait
+        here gives it a little extra room before giving up on it.
+        """
+        future = self._pool(pool).submit(_call, fn, args)
+        wait_timeout = timeout + 30 if timeout else None
+        if self.use_tpool and not _green_threading():
+            # Waiting on a real lock would block the hub, so wait in a native thread
+            return self.run(future.result, wait_timeout, timeout=wait_timeout, stage=stage)
+        try:
+            return future.result(wait_timeout)
+        except concurrent.futures.TimeoutError:
+            raise StageTimeout(f"{stage} timed out after {timeout}s")
+
+    def map_in_process(self, fn, arg_lists, timeout=None, stage='task', pool=FFMPEG):
+        """Call ``fn(*args)`` for every entry of ``arg_lists`` in parallel in the process pool ``pool``.
+
+        Returns a ``(result, error)`` pair per call, in order, so one failed
+        call does not throw away the others' results.
+        """
+        futures = [self._pool(pool).submit(_call, fn, args) for args in arg_lists]
+        wait_timeout = timeout + 30 if timeout else None
+        if self.use_tpool and not _green_threading():
+            self.run(concurrent.futures.wait, futures, wait_timeout, timeout=wait_timeout, stage=stage)
+        else:
+            concurrent.futures.wait(futures, wait_timeout)
+        outcomes = []
+        for future in futures:
+            if not future.done():
+                future.cancel()
+                outcomes.append((None, StageTimeout(f"{stage} timed out after {timeout}s")))
+            elif future.exception() is not None:
+                outcomes.append((None, future.exception()))
+            else:
+                outcomes.append((future.result(), None))
+        return outcomes
+
+    def _pool(self, name):
+        with self._process_pool_lock:
+            if name not in self._process_pools:
+                self._process_pools[name] = concurrent.futures.ProcessPoolExecutor(
+                    self.processes[name], mp_context=multiprocessing.get_context('spawn'),
+                    initializer=self._initializers.get(name),
+                )
+            return self._process_pools[name]
+
+
+def _call(fn, args):
+    """Runs in the worker process. Errors other than StageTimeout come back as a plain
+    Exception with the same message: the parent may not be able to unpickle yt-dlp's own.
+    """
+    try:
+        return fn(*args)
+    except StageTimeout:
+        raise
+    except Exception as e:
+        raise Exception(str(e)) from None
+
+
+def _green_threading():
+    """True when eventlet has monkey patched threading (e.g. gunicorn's eventlet worker)."""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
@@ -0,0 +1,98 @@
+import logging
+import threading
+
+_lock = threading.Lock()
+_adapters = {}
+_settings = {'pool_connections': 10, 'pool_maxsize': 32}
+_installed = False
+_handler = None
+
+
+def install_shared_pool(pool_hosts=10, pool_size=32):
+    """Make every YoutubeDL in this process share one HTTP connection pool per host.
+
+    yt-dlp normally builds a new requests session, and with it a new pool,
+    for every YoutubeDL instance, so each job pays for fresh TCP and TLS
+    handshakes. This registers a request handler that keeps yt-dlp's own
+    session (and cookie jar) per instance but mounts a process-wide adapter,
+    so keep-alive connections are reused across jobs and fragments.
+    ``pool_hosts`` hosts are kept, with up to ``pool_size`` idle connections
+    each. Returns False if the "requests" handler is not available.
+    """
+    global _installed
+    # yt-dlp is imported here rather than at the top, so importing this module stays cheap
+    try:
+        from yt_dlp.networking.common import register_preference, register_rh
+        handler = _shared_pool_handler()
+    except ImportError:  # yt-dlp without its "requests" handler
+        logging.warning("yt-dlp's requests handler is not available, connections will not be pooled")
+        return False
+    with _lock:
+        _settings.update(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        if not _installed:
+            register_rh(handler)
+            register_preference(handler)(_prefer_shared_pool)
+            _installed = True
+    return True
+
+
+def stats():
+    with _lock:
+        return {
+            'adapters': len(_adapters),
+            'hosts': sum(len(adapter.poolmanager.pools) for adapter in _adapters.values()),
+        }
+
+
+def _shared_adapter(key, make):
+    with _lock:
+        adapter = _adapters.get(key)
+        if adapter is None:
+            adapter = _adapters[key] = make()
+        return adapter
+
+
+def _prefer_shared_pool(rh, request):
+    # Above yt-dlp's own requests handler (100), so this one is used whenever it can be
+    return 200
+
+
+def _shared_pool_handler():
+    """The SharedPoolRH class, defined on first use since it subclasses a yt-dlp class."""
+    global _handler
+    if _handler is not None:
+        return _handler
+    import urllib3
+    from yt_dlp.networking._requests import RequestsHTTPAdapter, RequestsRH
+
+    class SharedPoolRH(RequestsRH):
+        """yt-dlp's requests handler, with connection pools shared across instances."""
+        RH_NAME = 'requests-shared-pool'
+
+        def _create_instance(self, cookiejar, legacy_ssl_support=None):
+            session = super()._create_instance(cookiejar, legacy_ssl_support)
+            if legacy_ssl_support is None:
+                legacy_ssl_support = self.legacy_ssl_support
+            # Everything that goes into the adapter's SSL context and sockets
+            key = (
+                self.verify, legacy_ssl_support, self.prefer_system_certs,
+                tuple(sorted(self._client_cert.items())), self.source_address,
+            )
+            adapter = _shared_adapter(key, lambda: RequestsHTTPAdapter(
+                ssl_context=self._make_sslcontext(legacy_ssl_support=legacy_ssl_support),
+                source_address=self.source_address,
+                max_retries=urllib3.util.retry.Retry(False),
+                **_settings,
+            ))
+            session.adapters.clear()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            return session
+
+        def _close_instance(self, instance):
+            # The adapter outlives this handler; closing the session must not close it
+            instance.adapters.clear()
+            super()._close_instance(instance)
+
+    _handler = SharedPoolRH
+    return _handler
@@ -0,0 +1,283 @@
+import contextlib
+import copy
+import json
+import sqlite3
+import threading
+import time
+
+# Lifecycle of a download job, in order.
+QUEUED = 'queued'
+FETCHING = 'fetching'
+DOWNLOADED = 'downloaded'  # fetched, waiting for an ffmpeg slot
+POSTPROCESSING = 'postprocessing'
+FINISHED = 'finished'
+ERROR = 'error'
+
+DONE = (FINISHED, ERROR)
+
+# Seconds a SQLiteJobStore call waits for another process's write transaction
+BUSY_TIMEOUT = 10
+
+
+def _new_job(job_id, fields):
+    now = time.time()
+    return {
+        'id': job_id,
+        'status': QUEUED,
+        'created': now,
+        'updated': now,
+        'filename': None,
+        'error': None,
+        **fields,
+    }
+
+
+def _matches(job, expect):
+    return not expect or all(job.get(key) == value for key, value in expect.items())
+
+
+class JobStore:
+    """In-memory record of download jobs, keyed by job ID.
+
+    Each job remembers its request, its current status and, once finished,
+    the exact file it produced, so /download_file and /jobs/<id> never have
+    to search OUTPUT_DIR.
+
+    ``update`` takes an optional ``expect`` dict and only applies the change
+    if the job's current fields match it, which lets workers hand jobs over
+    without racing each other.
+    """
+
+    def __init__(self, max_age=24 * 3600):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def create(self, job_id, **fields):
+        job = _new_job(job_id, fields)
+        with self._lock:
+            self._expire(job['created'])
+            self._jobs[job_id] = job
+            return copy.deepcopy(job)
+
+    def update(self, job_id, expect=None, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not _matches(job, expect):
+                return None
+            job.update(fields, updated=time.time())
+            return copy.deepcopy(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+    def unfinished(self):
+        """Jobs that are neither finished nor failed."""
+        with self._lock:
+            return [copy.deepcopy(job) for job in self._jobs.values() if job['status'] not in DONE]
+
+    def renew(self, owner):
+        """Refresh ``updated`` on every unfinished job ``owner`` holds; returns their IDs."""
+        now = time.time()
+        with self._lock:
+            owned = [job for job in self._jobs.values() if job['status'] not in DONE and job.get('owner') == owner]
+            for job in owned:
+                job['updated'] = now
+            return [job['id'] for job in owned]
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items() if now - job['updated'] > self.max_age]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job records in a local SQLite file, so they survive restarts of the process.
+
+    Same interface as JobStore. Every worker on the machine can share the
+    file; read-modify-write updates run in IMMEDIATE transactions.
+    """
+
+    def __init__(self, path, max_age=24 * 3600, namespace='jobs'):
+        if not namespace.isidentifier():
+            raise ValueError(f"Invalid job store namespace: {namespace}")
+        self.path = path
+        self.max_age = max_age
+        self._table = namespace
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._table} ('
+                ' id TEXT PRIMARY KEY,'
+                ' status TEXT NOT NULL,'
+                ' updated REAL NOT NULL,'
+                ' data TEXT NOT NULL)'
+            )
+            db.execute(f'CREATE INDEX IF NOT EXISTS {self._table}_status ON {self._table} (status)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit mode, so transactions are started explicitly where they are needed
+        db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            db.execute('PRAGMA synchronous=NORMAL')
+            yield db
+        finally:
+            db.close()
+
+    def create(self, job_id, **fields):
+        job = _new_job(job_id, fields)
+        with self._connect() as db:
+            db.execute(f'DELETE FROM {self._table} WHERE updated < ?', (job['created'] - self.max_age,))
+            db.execute(
+                f'INSERT OR REPLACE INTO {self._table} (id, status, updated, data) VALUES (?, ?, ?, ?)',
+                (job_id, job['status'], job['updated'], json.dumps(job)),
+            )
+        return json.loads(json.dumps(job))
+
+    def update(self, job_id, expect=None, **fields):
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(f'SELECT data FROM {self._table} WHERE id = ?', (job_id,)).fetchone()
+                job = json.loads(row[0]) if row is not None else None
+                if job is None or not _matches(job, expect):
+                    return None
+                job.update(fields, updated=time.time())
+                db.execute(
+                    f'UPDATE {self._table} SET status = ?, updated = ?, data = ? WHERE id = ?',
+                    (job['status'], job['updated'], json.dumps(job), job_id),
+                )
+                return job
+            finally:
+                db.execute('COMMIT')
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute(f'SELECT data FROM {self._table} WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def unfinished(self):
+        """Jobs that are neither finished nor failed."""
+        with self._connect() as db:
+            rows = db.execute(
+                f'SELECT data FROM {self._table} WHERE status NOT IN (?, ?) AND updated >= ?',
+                (*DONE, time.time() - self.max_age),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def renew(self, owner):
+        """Refresh ``updated`` on every unfinished job ``owner`` holds; returns their IDs.
+
+        A single UPDATE statement, without the read-modify-write of ``update``.
+        """
+        now = time.time()
+        with self._connect() as db:
+            rows = db.execute(
+                f"UPDATE {self._table} SET updated = ?, data = json_set(data, '$.updated', ?)"
+                f" WHERE status NOT IN (?, ?) AND json_extract(data, '$.owner') = ? RETURNING id",
+                (now, now, *DONE, owner),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def counts(self):
+        with self._connect() as db:
+            rows = db.execute(f'SELECT status, COUNT(*) FROM {self._table} GROUP BY status').fetchall()
+        return dict(rows)
+
+
+class RedisJobStore:
+    """Job records kept in Redis, shared by every worker (and node) using the same server.
+
+    Same interface as JobStore. Records are stored as JSON under
+    ``ytdl:<namespace>:<job_id>`` and expire ``max_age`` seconds after their
+    last update. Needs the ``redis`` package, which is optional
+    (requirements-redis.txt).
+    """
+
+    def __init__(self, url, max_age=24 * 3600, namespace='jobs'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'A Redis job store needs the redis package: pip install -r requirements-redis.txt'
+            ) from None
+        self.max_age = max_age
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self._prefix = f'ytdl:{namespace}:'
+
+    def create(self, job_id, **fields):
+        job = _new_job(job_id, fields)
+        self._redis.set(self._prefix + job_id, json.dumps(job), ex=self.max_age)
+        return json.loads(json.dumps(job))
+
+    def update(self, job_id, expect=None, **fields):
+        key = self._prefix + job_id
+        with self._redis.pipeline() as pipe:
+            while True:
+                try:
+                    # Optimistic read-modify-write: retried if another worker updated the job meanwhile
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    job = json.loads(raw) if raw is not None else None
+                    if job is None or not _matches(job, expect):
+                        pipe.unwatch()
+                        return None
+                    job.update(fields, updated=time.time())
+                    pipe.multi()
+                    pipe.set(key, json.dumps(job), ex=self.max_age)
+                    pipe.execute()
+                    return job
+                except self._watch_error:
+                    continue
+
+    def get(self, job_id):
+        raw = self._redis.get(self._prefix + job_id)
+        return json.loads(raw) if raw is not None else None
+
+    def unfinished(self):
+        """Jobs that are neither finished nor failed."""
+        return [job for job in self._scan() if job['status'] not in DONE]
+
+    def renew(self, owner):
+        """Refresh ``updated`` on every unfinished job ``owner`` holds; returns their IDs."""
+        return [
+            job['id'] for job in self.unfinished()
+            if job.get('owner') == owner and self.update(job['id'], expect={'owner': owner}) is not None
+        ]
+
+    def counts(self):
+        counts = {}
+        for job in self._scan():
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+    def _scan(self):
+        for key in self._redis.scan_iter(match=self._prefix + '*', count=500):
+            raw = self._redis.get(key)
+            if raw is not None:
+                yield json.loads(raw)
+
+
+def make_job_store(url=None, max_age=24 * 3600, namespace='jobs'):
+    """Job store for ``url``.
+
+    ``redis://`` (or ``rediss://``, ``unix://``) URLs give a RedisJobStore,
+    ``sqlite:///<path>`` a SQLiteJobStore, and anything else (including
+    ``memory://``) an in-process JobStore.
+    """
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobStore(url, max_age=max_age, namespace=namespace)
+    if url and url.startswith('sqlite:///'):
+        return SQLiteJobStore(url[len('sqlite:///'):], max_age=max_age, namespace=namespace)
+    return JobStore(max_age=max_age)
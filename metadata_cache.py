@@ -0,0 +1,225 @@
+import contextlib
+import json
+import logging
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+# Matches the 11 character video ID in the usual YouTube URL shapes
+# (watch?v=, youtu.be/, shorts/, embed/, live/, music.youtube.com, ...).
+YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:.*[?&]v=|shorts/|embed/|live/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})'
+)
+
+
+def normalize_video_key(url):
+    """Return a stable cache key for ``url`` (``youtube:<id>`` where possible)."""
+    url = (url or '').strip()
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    return f"url:{url}"
+
+
+class CachedExtractionError(Exception):
+    """Raised for a URL whose extraction failed recently (negative cache hit)."""
+
+
+class _Flight:
+    def __init__(self, make_event):
+        self.done = make_event()
+        self.info = None
+        self.error = None
+
+
+class MetadataCache:
+    """SQLite-backed cache of yt-dlp info dicts.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once there are more than ``max_entries``. Failed extractions are
+    remembered for ``negative_ttl`` seconds so a dead link is not re-extracted
+    on every click, and concurrent lookups of the same video share a single
+    extraction. Callers waiting for that extraction block on a ``make_event()``
+    (an eventlet app passes a green Event, so waiting does not block the hub).
+    """
+
+    def __init__(self, path, ttl=1800, max_entries=1000, negative_ttl=60, make_event=threading.Event):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.make_event = make_event
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'coalesced': 0, 'evictions': 0}
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                ' key TEXT PRIMARY KEY,'
+                ' info TEXT,'
+                ' error TEXT,'
+                ' expires REAL NOT NULL,'
+                ' last_access REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS metadata_last_access ON metadata (last_access)')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS handles ('
+                ' handle TEXT PRIMARY KEY,'
+                ' key TEXT NOT NULL,'
+                ' expires REAL NOT NULL)'
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """Return the cached info dict for ``key``, or None.
+
+        Raises CachedExtractionError if the key is negatively cached.
+        """
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT info, error FROM metadata WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE metadata SET last_access = ? WHERE key = ?', (now, key))
+        info, error = row
+        if error is not None:
+            self._count('negative_hits')
+            raise CachedExtractionError(error)
+        self._count('hits')
+        return json.loads(info)
+
+    def put(self, key, info):
+        self._store(key, json.dumps(info), None, self.ttl)
+
+    def put_error(self, key, error):
+        self._store(key, None, str(error), self.negative_ttl)
+
+    def _store(self, key, info, error, ttl):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO metadata (key, info, error, expires, last_access) VALUES (?, ?, ?, ?, ?)',
+                (key, info, error, now + ttl, now),
+            )
+            db.execute('DELETE FROM metadata WHERE expires <= ?', (now,))
+            evicted = db.execute(
+                'DELETE FROM metadata WHERE key IN ('
+                ' SELECT key FROM metadata ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            ).rowcount
+        if evicted > 0:
+            with self._lock:
+                self._stats['evictions'] += evicted
+
+    def contains(self, url):
+        """Whether ``get_or_extract(url)`` would be answered without a new extraction.
+
+        True for cached (also negatively cached) entries and for extractions already running.
+        """
+        key = normalize_video_key(url)
+        with self._lock:
+            if key in self._flights:
+                return True
+        with self._connect() as db:
+            row = db.execute('SELECT 1 FROM metadata WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return row is not None
+
+    def get_or_extract(self, url, extract):
+        """Return the info dict for ``url``, calling ``extract(url)`` on a miss.
+
+        Only one extraction per key runs at a time; other callers asking for
+        the same video wait for it and share its result (or its error).
+        """
+        key = normalize_video_key(url)
+        info = self.get(key)
+        if info is not None:
+            return info
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(self.make_event)
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.info
+
+        try:
+            started = time.time()
+            flight.info = extract(url)
+            logging.info(f"Extracted metadata for {key} in {time.time() - started:.2f}s")
+            self.put(key, flight.info)
+            return flight.info
+        except Exception as e:
+            flight.error = e
+            self.put_error(key, e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def issue_handle(self, url):
+        """Return an opaque token that refers to the cached info dict for ``url``.
+
+        The handle lives as long as the metadata entry would, so it can be
+        passed from /get_download_url to /download without leaking the
+        cache key (or the info dict itself) to the client.
+        """
+        handle = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO handles (handle, key, expires) VALUES (?, ?, ?)',
+                (handle, normalize_video_key(url), now + self.ttl),
+            )
+            db.execute('DELETE FROM handles WHERE expires <= ?', (now,))
+        return handle
+
+    def resolve_handle(self, handle, url):
+        """Return the info dict behind ``handle``, or None if it expired.
+
+        A handle issued for a different video than ``url`` is ignored.
+        """
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT key FROM handles WHERE handle = ? AND expires > ?', (handle, time.time())
+            ).fetchone()
+        if row is None or row[0] != normalize_video_key(url):
+            return None
+        try:
+            return self.get(row[0])
+        except CachedExtractionError:
+            return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0.0
+        with self._connect() as db:
+            stats['entries'] = db.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+        return stats
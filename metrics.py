@@ -0,0 +1,149 @@
+import json
+import logging
+import math
+import threading
+
+# Latency buckets in seconds, from a cached lookup up to a long transcode
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(Counter):
+    """Observations counted into cumulative ``buckets``, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            for bound, count in zip(self.buckets, counts):
+                samples.append((self.name + '_bucket', key + (('le', _format_value(bound)),), count))
+            samples.append((self.name + '_sum', key, total))
+            samples.append((self.name + '_count', key, counts[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics of this process, rendered in the Prometheus text exposition format.
+
+    Counters and histograms are updated as things happen; gauges are read
+    from the functions given to ``gauge`` at scrape time, so queue depths and
+    cache statistics need no bookkeeping of their own.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(self.prefix + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self.prefix + name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, read, labelname=None):
+        """Register a gauge read by ``read()``.
+
+        With ``labelname``, ``read`` returns a dict of label value to number.
+        """
+        self._gauges.append((self.prefix + name, help, read, labelname))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for name, help, read, labelname in self._gauges:
+            try:
+                value = read()
+            except Exception as e:
+                logging.error(f"Error reading metric {name}: {str(e)}")
+                continue
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+            values = value.items() if labelname else [(None, value)]
+            for label, number in values:
+                labels = ((labelname, label),) if labelname else ()
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(number)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TraceLog:
+    """Optional structured log with one JSON line per finished job.
+
+    Does nothing when ``path`` is empty.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        if not self.path:
+            return
+        line = json.dumps(record, default=str, sort_keys=True)
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logging.warning(f"Could not write job trace: {str(e)}")
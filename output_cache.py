@@ -0,0 +1,122 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_output_key(video_key, format_type, quality, ydl_opts):
+    """Hash everything that decides what ends up in the output file."""
+    settings = {
+        'video': video_key,
+        'format_type': format_type,
+        'quality': quality,
+        'format': ydl_opts.get('format'),
+        'merge_output_format': ydl_opts.get('merge_output_format'),
+        'postprocessors': ydl_opts.get('postprocessors', []),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class OutputCache:
+    """Index of finished files in the output directory, keyed by output key.
+
+    The index lives in SQLite next to the files so it is shared by every
+    worker using the same directory. Outputs that are still being produced
+    are claimed in the same database, so that a second request for the same
+    output (on any worker) can attach to the running job instead of starting
+    a duplicate download. Claims not renewed (see ``renew_claims``) for
+    ``claim_ttl`` seconds are considered abandoned.
+    """
+
+    def __init__(self, output_dir, path, claim_ttl=3600):
+        self.output_dir = output_dir
+        self.path = path
+        self.claim_ttl = claim_ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'attached': 0}
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS outputs ('
+                ' key TEXT PRIMARY KEY,'
+                ' filename TEXT NOT NULL,'
+                ' created REAL NOT NULL)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS claims ('
+                ' key TEXT PRIMARY KEY,'
+                ' job_id TEXT NOT NULL,'
+                ' created REAL NOT NULL)'
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def lookup(self, key):
+        """Return the cached filename for ``key`` if the file is still on disk."""
+        with self._connect() as db:
+            row = db.execute('SELECT filename FROM outputs WHERE key = ?', (key,)).fetchone()
+            if row is not None and not os.path.exists(os.path.join(self.output_dir, row[0])):
+                db.execute('DELETE FROM outputs WHERE key = ?', (key,))
+                row = None
+        with self._lock:
+            self._stats['hits' if row else 'misses'] += 1
+        return row[0] if row else None
+
+    def store(self, key, filename):
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO outputs (key, filename, created) VALUES (?, ?, ?)',
+                (key, filename, time.time()),
+            )
+
+    def forget_file(self, filename):
+        """Drop every index entry pointing at ``filename`` (e.g. after deleting it)."""
+        with self._connect() as db:
+            db.execute('DELETE FROM outputs WHERE filename = ?', (filename,))
+
+    def claim(self, key, job_id):
+        """Mark ``key`` as being produced by ``job_id``.
+
+        Returns None if the claim succeeded, or the id of the job that is
+        already producing this output.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute('DELETE FROM claims WHERE key = ? AND created < ?', (key, now - self.claim_ttl))
+            db.execute('INSERT OR IGNORE INTO claims (key, job_id, created) VALUES (?, ?, ?)', (key, job_id, now))
+            running = db.execute('SELECT job_id FROM claims WHERE key = ?', (key,)).fetchone()[0]
+        if running == job_id:
+            return None
+        with self._lock:
+            self._stats['attached'] += 1
+        return running
+
+    def renew_claims(self, job_ids):
+        """Keep the claims of ``job_ids``, jobs that are still running, from being considered abandoned."""
+        now = time.time()
+        with self._connect() as db:
+            db.executemany('UPDATE claims SET created = ? WHERE job_id = ?', [(now, job_id) for job_id in job_ids])
+
+    def release(self, key):
+        with self._connect() as db:
+            db.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+    def stats(self):
+        with self._connect() as db:
+            inflight = db.execute('SELECT COUNT(*) FROM claims').fetchone()[0]
+        with self._lock:
+            stats = dict(self._stats)
+        stats['inflight'] = inflight
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
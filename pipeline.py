@@ -0,0 +1,400 @@
+# The download pipeline shared by the web app (app.py) and the bulk CLI
+# (bulk.py): yt-dlp options per output format, the fetch, the ffmpeg
+# postprocessing and publishing the result into the output directory.
+# Nothing in here knows about Flask, Socket.IO or the scheduler.
+import atexit
+import functools
+import logging
+import os
+import shutil
+import threading
+import time
+
+import http_pool
+from executor import deadline
+from metadata_cache import MetadataCache, normalize_video_key
+from output_cache import OutputCache, make_output_key
+from transcode import mp4_postprocessors, run_postprocessors
+from ydl_pool import YoutubeDLPool
+
+# Formats a job can produce; one job may ask for several of them at once
+DOWNLOAD_FORMATS = ('mp3', 'mp4', 'wav')
+
+# HLS/DASH formats are fetched CONCURRENT_FRAGMENTS fragments at a time and large
+# progressive files in HTTP_CHUNK_SIZE range requests (0 disables chunking).
+CONCURRENT_FRAGMENTS = int(os.environ.get('CONCURRENT_FRAGMENTS', 4))
+HTTP_CHUNK_SIZE = int(os.environ.get('HTTP_CHUNK_SIZE', 10 * 1024 * 1024))
+
+
+def mp4_format_selector(height=None):
+    """Format selection for MP4 output that prefers H.264/AAC, so the result can be stream-copied.
+
+    Falls back to any codecs (which then get transcoded) when no compatible
+    format exists at the requested height.
+    """
+    limit = f'[height<={height}]' if height else ''
+    return '/'.join([
+        f'best{limit}[vcodec^=avc1][acodec^=mp4a]',
+        f'bestvideo{limit}[vcodec^=avc1]+bestaudio[acodec^=mp4a]',
+        f'best{limit}',
+        f'bestvideo{limit}+bestaudio',
+        'best',
+    ])
+
+
+# Use yt-dlp's native HLS/m3u8 handling - it can download and convert to MP4
+# More robust format selection that handles HLS streams
+MP4_QUALITY_MAP = {
+    '1080p': mp4_format_selector(1080),
+    '720p': mp4_format_selector(720),
+    '480p': mp4_format_selector(480),
+    '360p': mp4_format_selector(360),
+    'best': mp4_format_selector(),
+}
+
+
+# --- YOUTUBEDL POOL ---
+# Warm YoutubeDL instances per option profile, with cookies.txt parsed once per
+# change rather than per job; yt-dlp is imported on first use or by preload().
+ydl_pool = YoutubeDLPool(
+    max_idle=int(os.environ.get('YDL_POOL_IDLE', 4)),
+    max_uses=int(os.environ.get('YDL_POOL_MAX_USES', 200)),
+)
+# Cookies the sites set during this process's jobs are written back on exit
+atexit.register(ydl_pool.close)
+
+
+def init_worker(warm=False, pool_hosts=10, pool_size=32):
+    """Set up a process that runs the yt-dlp stages (a web app worker process or a bulk worker).
+
+    Every YoutubeDL in the process shares one keep-alive connection pool per
+    host (see http_pool.py), installed as soon as yt-dlp is loaded; ``warm``
+    also loads yt-dlp and builds the instances of ``warm_profiles()`` now.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ydl_pool.on_load(functools.partial(http_pool.install_shared_pool, pool_hosts=pool_hosts, pool_size=pool_size))
+    if warm:
+        try:
+            ydl_pool.warm(warm_profiles())
+        except Exception as e:
+            logging.warning(f"Could not warm up yt-dlp: {str(e)}")
+
+
+def worker_stats():
+    """Pool statistics of the calling worker process."""
+    return {'pid': os.getpid(), 'ydl_pool': ydl_pool.stats(), 'http_pool': http_pool.stats()}
+
+
+# --- SHARED CACHES ---
+# The web app and the CLI open the same SQLite files, so each sees what the other extracted and produced.
+
+def make_metadata_cache(make_event=threading.Event):
+    """extract_info results kept on disk (so they survive restarts) keyed by video ID.
+
+    ``make_event`` is the Event class callers waiting for a shared extraction block on.
+    """
+    return MetadataCache(
+        os.environ.get('METADATA_CACHE_DB', os.path.join(os.getcwd(), 'metadata_cache.sqlite3')),
+        ttl=int(os.environ.get('METADATA_CACHE_TTL', 1800)),
+        max_entries=int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', 1000)),
+        negative_ttl=int(os.environ.get('METADATA_CACHE_NEGATIVE_TTL', 60)),
+        make_event=make_event,
+    )
+
+
+def make_output_cache(output_dir):
+    """Index of the finished files in ``output_dir`` by (video, format, quality, postprocessor settings)."""
+    return OutputCache(
+        output_dir,
+        os.path.join(output_dir, '.output_index.sqlite3'),
+        claim_ttl=int(os.environ.get('OUTPUT_CLAIM_TTL', 3600)),
+    )
+
+
+# --- YT-DLP OPTIONS ---
+
+def _common_opts(cookies_path=None):
+    cookies_path = cookies_path or os.path.join(os.getcwd(), 'cookies.txt')
+    opts = {
+        'nocheckcertificate': True,
+        # Use mweb client as recommended for current YouTube issues
+        'extractor_args': {
+            'youtube': {
+                'client': ['mweb'],
+                'lang': ['en'],
+                'region': ['US']
+            }
+        },
+        # Use a realistic user agent
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        }
+    }
+    if os.path.exists(cookies_path):
+        # Parsed by ydl_pool, once per change of the file
+        opts['cookiefile'] = cookies_path
+    return opts
+
+
+def extraction_opts(cookies_path=None):
+    """yt-dlp options for metadata extraction (no download)."""
+    return {
+        **_common_opts(cookies_path),
+        'quiet': True,  # Reduce noise for URL extraction
+    }
+
+
+def base_download_opts(cookies_path=None):
+    """yt-dlp options every download starts from, whatever the output format."""
+    opts = {
+        **_common_opts(cookies_path),
+        # The video ID keeps different videos with the same title apart
+        'outtmpl': '%(title)s [%(id)s].%(ext)s',
+        'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
+    }
+    if HTTP_CHUNK_SIZE:
+        opts['http_chunk_size'] = HTTP_CHUNK_SIZE
+    return opts
+
+
+def download_opts(format_type, quality, base_opts):
+    """yt-dlp options (format selection and postprocessors) for one output format."""
+    if format_type == 'mp3':
+        return {
+            **base_opts,
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }],
+        }
+    if format_type == 'mp4':
+        return {
+            **base_opts,
+            'format': MP4_QUALITY_MAP.get(quality, MP4_QUALITY_MAP['best']),
+            'merge_output_format': 'mp4',  # Force final output to be MP4
+            # The quality keeps each rendition in its own file; the fetched file keeps
+            # its real extension and the postprocessor below produces the .mp4
+            'outtmpl': f'%(title)s [%(id)s] {quality}.%(ext)s',
+            # Replaced after the fetch by a remux, or nothing, when the codecs allow (see transcode.py)
+            'postprocessors': [{
+                'key': 'FFmpegVideoConvertor',
+                'preferedformat': 'mp4',
+            }],
+        }
+    if format_type == 'wav':
+        return {
+            **base_opts,
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'wav',
+            }],
+        }
+    return None
+
+
+def warm_profiles(cookies_path=None):
+    """Options of the instances worth building ahead of the first request: extraction and each single-format fetch."""
+    base_opts = base_download_opts(cookies_path)
+    fetches = [download_opts(fmt, 'best', base_opts) for fmt in DOWNLOAD_FORMATS if fmt != 'mp4']
+    fetches += [download_opts('mp4', quality, base_opts) for quality in MP4_QUALITY_MAP]
+    return [extraction_opts(cookies_path)] + [
+        {k: v for k, v in opts.items() if k != 'postprocessors'} for opts in fetches
+    ]
+
+
+def plan_download(video_url, formats, quality, base_opts):
+    """yt-dlp options and output cache keys for a job producing each of ``formats``.
+
+    Returns the options per format, the options of the one fetch they all
+    share and the output cache key per format. Raises ValueError for an
+    unknown format.
+    """
+    if not formats or any(fmt not in DOWNLOAD_FORMATS for fmt in formats):
+        raise ValueError('Invalid format')
+    opts_by_format = {fmt: download_opts(fmt, quality, base_opts) for fmt in formats}
+    # One fetch serves every requested format: the mp4 selection when video is
+    # wanted (audio is then extracted from it), otherwise the best audio.
+    # Fanned-out audio outputs record that source in their options, so they are
+    # cached apart from outputs made from a bestaudio fetch.
+    source_opts = opts_by_format['mp4' if 'mp4' in formats else formats[0]]
+    if len(formats) > 1:
+        for opts in opts_by_format.values():
+            # Every encode reads the same source file, so none may delete it
+            opts.update(format=source_opts['format'], outtmpl=source_opts['outtmpl'], keepvideo=True)
+    video_key = normalize_video_key(video_url)
+    output_keys = {fmt: make_output_key(video_key, fmt, quality, opts) for fmt, opts in opts_by_format.items()}
+    return opts_by_format, source_opts, output_keys
+
+
+def fetch_opts_for(opts_by_format, source_opts, work_dir):
+    """Point every format's options at ``work_dir`` and return the options for the fetch.
+
+    The download itself runs without postprocessors so the network fetch
+    and the ffmpeg step can be scheduled (and timed) separately.
+    """
+    for opts in opts_by_format.values():
+        opts['paths'] = {'home': work_dir}
+    return {k: v for k, v in source_opts.items() if k != 'postprocessors'}
+
+
+# --- PIPELINE STAGES ---
+# Each stage raises StageTimeout after ``timeout`` seconds (see executor.deadline), so it
+# must run in a process's main thread: the web app runs them in its yt-dlp worker processes.
+# Info dicts are returned sanitized (JSON-compatible), ready to be cached or sent to another process.
+
+def unselected_info(ydl, info):
+    """``info`` without the result of an earlier format selection, so it can be selected again.
+
+    Processing copies the chosen format(s) onto the info dict (``format_id``, ``url``, ``ext``,
+    ``requested_formats``, ...) and processing it again keeps whatever the new choice does not
+    overwrite: a ``bestaudio`` selection would still fetch the old video + audio pair.
+    """
+    info = ydl.sanitize_info(info, remove_private_keys=True)
+    formats = info.get('formats')
+    if formats and 'format_id' in info:
+        for key in set().union(*formats):
+            info.pop(key, None)
+    return info
+
+
+def extract_video_info(url, ydl_opts, timeout=None):
+    """Extract (without downloading) the info dict for ``url``."""
+    with deadline(timeout, 'extract'), ydl_pool.get(ydl_opts) as ydl:
+        # Extract video info without downloading; it is cached and selected again per request
+        return unselected_info(ydl, ydl.extract_info(url, download=False))
+
+
+def fetch_media(ydl_opts, url, info=None, timeout=None):
+    """Download ``url`` (or an already extracted ``info``) without postprocessing.
+
+    Returns the info dict and whether a fresh extraction was needed.
+    """
+    with deadline(timeout, 'fetch'), ydl_pool.get(ydl_opts) as ydl:
+        # Only once the pool has loaded yt-dlp: importing it from two threads at once breaks
+        from yt_dlp.utils import DownloadError
+
+        if info is None:
+            return ydl.sanitize_info(ydl.extract_info(url, download=True)), False
+        try:
+            return ydl.sanitize_info(ydl.process_ie_result(unselected_info(ydl, info), download=True)), False
+        except DownloadError:
+            # Cached stream URLs can go stale; extract again like yt-dlp's --load-info-json does
+            return ydl.sanitize_info(ydl.extract_info(url, download=True)), True
+
+
+def expand_playlist(url, ydl_opts, timeout=None):
+    """Entry URLs of the playlist at ``url`` from a flat extraction; ``[url]`` for a single video."""
+    with deadline(timeout, 'extract'), ydl_pool.get({**ydl_opts, 'extract_flat': 'in_playlist'}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [url]
+    entries = (entry for entry in info.get('entries') or [] if entry)
+    return [entry.get('url') or entry.get('webpage_url') for entry in entries if entry.get('url') or entry.get('webpage_url')]
+
+
+def select_formats(info, ydl_opts, timeout=None):
+    """Resolve the format selection in ``ydl_opts`` against an extracted ``info``, without downloading."""
+    with deadline(timeout, 'extract'), ydl_pool.get(ydl_opts) as ydl:
+        return ydl.sanitize_info(ydl.process_ie_result(unselected_info(ydl, info), download=False))
+
+
+def fetched_source(info):
+    """Path of the file a fetch produced and the bytes it downloaded."""
+    downloads = info.get('requested_downloads') or [info]
+    source_path = downloads[-1].get('filepath') or downloads[-1].get('_filename')
+    fetched = sum(
+        os.path.getsize(path) for path in (download.get('filepath') for download in downloads)
+        if path and os.path.exists(path)
+    )
+    return source_path, fetched
+
+
+def choose_mp4_conversion(info, opts_by_format):
+    """Stream copy whenever the fetched codecs fit in MP4; transcode only when they don't.
+
+    Updates the mp4 options in place and returns the MP4_* path taken.
+    """
+    mp4_conversion, postprocessors = mp4_postprocessors(info)
+    opts_by_format['mp4'] = {**opts_by_format['mp4'], 'postprocessors': postprocessors}
+    return mp4_conversion
+
+
+def publish_output(final_path, output_dir):
+    """Move a finished file from its work directory into ``output_dir``; returns its name and size."""
+    if not os.path.exists(final_path):
+        raise Exception(f"Downloaded file not found. Expected: {final_path}")
+    base_filename = os.path.basename(final_path)
+    os.replace(final_path, os.path.join(output_dir, base_filename))
+    return base_filename, os.path.getsize(os.path.join(output_dir, base_filename))
+
+
+def run_download(video_url, formats, quality, output_dir, work_dir, metadata_cache, output_cache,
+                 postprocess_timeout=None, cookies_path=None):
+    """Run the whole pipeline for one URL in this process, skipping outputs that are already cached.
+
+    Blocking; meant for the bulk CLI, where every worker process runs one job
+    at a time. Returns a dict with the outcome ('done', 'cached' or 'error'),
+    the output file per format, per-stage timings in seconds, bytes fetched
+    and produced, and ffmpeg CPU seconds per format.
+    """
+    started = time.monotonic()
+    result = {'url': video_url, 'formats': formats, 'quality': quality, 'status': 'error',
+              'outputs': {}, 'errors': {}, 'timings': {}, 'bytes': {}, 'ffmpeg_cpu_seconds': {}}
+
+    def timed(stage, stage_started):
+        result['timings'][stage] = round(time.monotonic() - stage_started, 3)
+
+    try:
+        opts_by_format, source_opts, output_keys = plan_download(
+            video_url, formats, quality, base_download_opts(cookies_path),
+        )
+        for fmt, key in output_keys.items():
+            cached_filename = output_cache.lookup(key)
+            if cached_filename:
+                result['outputs'][fmt] = cached_filename
+        pending_formats = [fmt for fmt in formats if fmt not in result['outputs']]
+        if not pending_formats:
+            result['status'] = 'cached'
+            return result
+
+        fetch_opts = fetch_opts_for(opts_by_format, source_opts, work_dir)
+        fetch_opts['quiet'] = fetch_opts['noprogress'] = True
+        stage_started = time.monotonic()
+        info = metadata_cache.get_or_extract(
+            video_url, lambda url: extract_video_info(url, extraction_opts(cookies_path)),
+        )
+        timed('extract', stage_started)
+
+        stage_started = time.monotonic()
+        info, _ = fetch_media(fetch_opts, video_url, info)
+        timed('fetch', stage_started)
+        source_path, result['bytes']['fetched'] = fetched_source(info)
+
+        if 'mp4' in pending_formats:
+            result['mp4_conversion'] = choose_mp4_conversion(info, opts_by_format)
+        stage_started = time.monotonic()
+        for fmt in pending_formats:
+            try:
+                final_path, cpu_seconds = run_postprocessors(
+                    {**opts_by_format[fmt], 'quiet': True}, info, source_path, postprocess_timeout,
+                )
+                result['ffmpeg_cpu_seconds'][fmt] = round(cpu_seconds, 3)
+                base_filename, result['bytes'][fmt] = publish_output(final_path, output_dir)
+            except Exception as e:
+                logging.error(f"{fmt.upper()} output failed for {video_url}: {str(e)}")
+                result['errors'][fmt] = str(e)
+                continue
+            output_cache.store(output_keys[fmt], base_filename)
+            result['outputs'][fmt] = base_filename
+        timed('postprocess', stage_started)
+        result['status'] = 'error' if len(result['errors']) == len(pending_formats) else 'done'
+    except Exception as e:
+        logging.error(f"Download failed for {video_url}: {str(e)}")
+        result['error'] = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        result['timings']['total'] = round(time.monotonic() - started, 3)
+    return result
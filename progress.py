@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class ProgressThrottle:
+    """yt-dlp progress hook that coalesces ticks into compact, rate-limited events.
+
+    yt-dlp calls its hooks many times per second; this forwards at most
+    ``max_rate`` updates per second, and only when the percentage moved by at
+    least ``min_step``. The final tick of each file is always sent. Payloads
+    are plain numbers (percent, bytes, bytes/s, seconds) rather than yt-dlp's
+    preformatted strings. yt-dlp also calls it from its fragment download
+    threads, so the check and the emit happen under a lock (ticks stay in
+    order). Picklable, so it travels to a worker process with the hooks.
+    """
+
+    def __init__(self, emit, max_rate=4.0, min_step=0.1, should_stop=None):
+        self.emit = emit
+        self.should_stop = should_stop
+        self.interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.min_step = min_step
+        self._last_sent = 0.0
+        self._last_percent = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, d):
+        if self.should_stop and self.should_stop():
+            # Raising from a progress hook is how yt-dlp downloads are aborted
+            # (imported here: hooks only run once yt-dlp is loaded anyway)
+            from yt_dlp.utils import DownloadCancelled
+            raise DownloadCancelled('Download cancelled')
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        try:
+            percent = self._percent(d)
+            with self._lock:
+                now = time.monotonic()
+                if d['status'] == 'downloading':
+                    if now - self._last_sent < self.interval:
+                        return
+                    if self._last_percent is not None and abs(percent - self._last_percent) < self.min_step:
+                        return
+                self._last_sent = now
+                self._last_percent = percent
+                self.emit({
+                    'p': round(percent, 1),
+                    'b': d.get('downloaded_bytes') or 0,
+                    't': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+                    's': round(d['speed']) if d.get('speed') else None,
+                    'e': int(d['eta']) if d.get('eta') is not None else None,
+                })
+        except Exception as e:
+            logging.error(f"Error in progress hook: {str(e)}")
+
+    @staticmethod
+    def _percent(d):
+        if d['status'] == 'finished':
+            return 100.0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if total:
+            return min(100.0, 100.0 * (d.get('downloaded_bytes') or 0) / total)
+        if d.get('fragment_count'):
+            return min(100.0, 100.0 * (d.get('fragment_index') or 0) / d['fragment_count'])
+        return 0.0
+
+
+class ProgressFile:
+    """Hands progress payloads from a yt-dlp worker process to a green emitter.
+
+    The worker's hook ``put``s the latest payload into a small JSON file,
+    replaced atomically; the emitter polls ``take`` at the progress rate.
+    Picklable, so it travels to the worker with the hooks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+        self._last = None
+
+    def put(self, payload):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # yt-dlp may call the hooks from its fragment download threads
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.path)
+
+    def take(self):
+        """The latest payload if it changed since the last ``take``, else None."""
+        try:
+            with open(self.path) as f:
+                content = f.read()
+        except OSError:
+            return None
+        if not content or content == self._last:
+            return None
+        self._last = content
+        return json.loads(content)
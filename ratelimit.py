@@ -0,0 +1,114 @@
+import collections
+import math
+import os
+import shutil
+import threading
+import time
+
+
+class RateLimiter:
+    """Token buckets keyed by client, video or anything else.
+
+    Each key gets a bucket of ``burst`` tokens that refills at ``rate`` tokens
+    per second; a request takes one token. At most ``max_keys`` buckets are
+    kept, least recently used first out (a dropped bucket just starts full
+    again). A ``rate`` of 0 disables the limiter.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+        self._rejected = 0
+
+    def acquire(self, key, cost=1):
+        """Take ``cost`` tokens for ``key``.
+
+        Returns 0 if the request may go ahead, otherwise the number of
+        seconds until enough tokens will be available.
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / self.rate
+                self._rejected += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {'rate': self.rate, 'burst': self.burst, 'keys': len(self._buckets), 'rejected': self._rejected}
+
+
+class AdmissionController:
+    """Decides whether this node can take on another download right now.
+
+    A node is saturated when its download queue is ``max_queue_fill`` full
+    (``queue_stats`` returns the scheduler's stats), when the 1-minute load
+    average per CPU is above ``max_load``, or when less than ``min_free_bytes``
+    are free in ``directory``. ``check`` then says why and how long the
+    client should wait before trying again.
+    """
+
+    def __init__(self, queue_stats, directory, max_queue_fill=0.9, max_load=0, min_free_bytes=0, retry_after=30):
+        self.queue_stats = queue_stats
+        self.directory = directory
+        self.max_queue_fill = max_queue_fill
+        self.max_load = max_load
+        self.min_free_bytes = min_free_bytes
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._rejected = collections.Counter()
+
+    def check(self):
+        """None if a new job can be admitted, otherwise ``(reason, retry_after_seconds)``."""
+        rejection = self._saturation()
+        if rejection is not None:
+            with self._lock:
+                self._rejected[rejection[0]] += 1
+        return rejection
+
+    def _saturation(self):
+        queue = self.queue_stats()
+        if queue['queued'] >= max(1, math.ceil(queue['max_queued'] * self.max_queue_fill)):
+            # Roughly the time it takes the fetch slots to work through the queue
+            return 'queue', self.retry_after * max(1, queue['queued'] // max(1, queue['fetch_slots']))
+        if self.max_load > 0 and self._load() > self.max_load:
+            return 'cpu', self.retry_after
+        if self.min_free_bytes > 0 and shutil.disk_usage(self.directory).free < self.min_free_bytes:
+            # Space comes back when the storage janitor evicts files
+            return 'disk', self.retry_after * 4
+        return None
+
+    def _load(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):  # not available on this platform
+            return 0
+
+    def stats(self):
+        with self._lock:
+            rejected = dict(self._rejected)
+        return {
+            'load_per_cpu': round(self._load(), 2),
+            'free_bytes': shutil.disk_usage(self.directory).free,
+            'max_load': self.max_load,
+            'min_free_bytes': self.min_free_bytes,
+            'rejected': rejected,
+        }
+
+
+def retry_after_header(seconds):
+    """Value for a Retry-After header: whole seconds, at least 1."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,120 @@
+import collections
+import logging
+import threading
+
+
+class QueueFull(Exception):
+    """Raised when the scheduler has no room for another waiting job."""
+
+
+class _Stage:
+    """A FIFO of pending work items with a fixed number of concurrent slots.
+
+    Nothing in here blocks: work is handed to ``spawn`` (normally
+    ``socketio.start_background_task``) as soon as a slot frees up, so the
+    stage behaves the same under eventlet green threads and real threads.
+    """
+
+    def __init__(self, name, slots, spawn):
+        self.name = name
+        self.slots = max(1, int(slots))
+        self.spawn = spawn
+        self.pending = collections.deque()
+        self.running = 0
+
+    def positions(self):
+        return {job_id: index + 1 for index, (job_id, _) in enumerate(self.pending)}
+
+
+class DownloadScheduler:
+    """Bounded two-stage job scheduler.
+
+    Every job is split into a network ``fetch`` step and an ffmpeg
+    ``postprocess`` step. Each stage has its own concurrency limit so that
+    transcodes never starve downloads of bandwidth (or the other way round),
+    and at most ``max_queued`` jobs may wait for a fetch slot at once.
+    """
+
+    def __init__(self, spawn, max_queued=50, fetch_slots=3, ffmpeg_slots=2, on_position=None):
+        self.max_queued = int(max_queued)
+        self.on_position = on_position
+        self._lock = threading.Lock()
+        self._fetch = _Stage('fetch', fetch_slots, spawn)
+        self._ffmpeg = _Stage('ffmpeg', ffmpeg_slots, spawn)
+
+    def submit(self, job_id, fetch, postprocess, on_error):
+        """Queue a job and return its position (0 means it started right away).
+
+        ``fetch()`` runs under a fetch slot and its return value is passed to
+        ``postprocess(result)``, which runs under an ffmpeg slot. Any exception
+        from either step is handed to ``on_error(exc)``.
+        """
+        with self._lock:
+            if len(self._fetch.pending) >= self.max_queued:
+                raise QueueFull(f"Download queue is full ({self.max_queued} jobs waiting)")
+            self._fetch.pending.append((job_id, (fetch, postprocess, on_error)))
+        self._dispatch(self._fetch)
+        return self.position(job_id)
+
+    def position(self, job_id):
+        """1-based place of ``job_id`` in the fetch queue, or 0 if it is not waiting."""
+        with self._lock:
+            return self._fetch.positions().get(job_id, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._fetch.pending),
+                'fetching': self._fetch.running,
+                'waiting_for_ffmpeg': len(self._ffmpeg.pending),
+                'postprocessing': self._ffmpeg.running,
+                'max_queued': self.max_queued,
+                'fetch_slots': self._fetch.slots,
+                'ffmpeg_slots': self._ffmpeg.slots,
+            }
+
+    def _dispatch(self, stage):
+        started = []
+        with self._lock:
+            while stage.pending and stage.running < stage.slots:
+                started.append(stage.pending.popleft())
+                stage.running += 1
+            positions = stage.positions() if started and stage is self._fetch else None
+
+        for job_id, work in started:
+            runner = self._run_fetch if stage is self._fetch else self._run_postprocess
+            stage.spawn(runner, job_id, *work)
+
+        if positions and self.on_position:
+            for job_id, position in positions.items():
+                try:
+                    self.on_position(job_id, position)
+                except Exception as e:
+                    logging.error(f"Error reporting queue position for job {job_id}: {str(e)}")
+
+    def _release(self, stage):
+        with self._lock:
+            stage.running -= 1
+        self._dispatch(stage)
+
+    def _run_fetch(self, job_id, fetch, postprocess, on_error):
+        try:
+            result = fetch()
+        except Exception as e:
+            self._release(self._fetch)
+            on_error(e)
+            return
+        # Hand over to the ffmpeg stage before freeing the fetch slot so the
+        # job keeps its place relative to jobs that are still downloading.
+        with self._lock:
+            self._ffmpeg.pending.append((job_id, (postprocess, result, on_error)))
+        self._release(self._fetch)
+        self._dispatch(self._ffmpeg)
+
+    def _run_postprocess(self, job_id, postprocess, result, on_error):
+        try:
+            postprocess(result)
+        except Exception as e:
+            on_error(e)
+        finally:
+            self._release(self._ffmpeg)
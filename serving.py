@@ -0,0 +1,196 @@
+import hashlib
+import io
+import mimetypes
+import os
+import unicodedata
+import zipfile
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.security import safe_join
+
+# Read size for the userspace fallback (bounded ranges, servers without sendfile)
+BLOCK_SIZE = 256 * 1024
+
+
+def content_disposition_header(download_name):
+    """``attachment`` Content-Disposition value, with an RFC 5987 name for non-ASCII titles."""
+    ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    ascii_name = ascii_name.replace('"', '').replace('\\', '') or 'download'
+    if ascii_name == download_name:
+        return f'attachment; filename="{ascii_name}"'
+    return f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(download_name, safe="")}'
+
+
+def file_etag(st):
+    """Strong ETag for a finished output file.
+
+    Output files are never modified in place (they are renamed into
+    OUTPUT_DIR when complete), so inode, size and mtime identify the bytes.
+    """
+    token = f'{st.st_ino}-{st.st_size}-{st.st_mtime_ns}'.encode('ascii')
+    return hashlib.sha1(token).hexdigest()
+
+
+class _ServedFile(io.FileIO):
+    """File that runs ``on_close`` once the server is done sending it."""
+
+    def __init__(self, path, on_close=None):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        try:
+            super().close()
+        finally:
+            if on_close:
+                on_close()
+
+
+def _iter_range(f, length):
+    try:
+        while length > 0:
+            chunk = f.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _range_allowed(etag, st):
+    """Apply the If-Range precondition: only honour Range if the client's copy is current."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Strong comparison; weak validators never match If-Range
+        return if_range == f'"{etag}"'
+    if if_range.startswith('W/'):
+        return False
+    return request.if_range.date is not None and int(st.st_mtime) <= request.if_range.date.timestamp()
+
+
+def send_output_file(directory, filename, download_name=None, on_close=None, accel_prefix=None):
+    """Serve ``directory/filename`` with ETag, conditional GET and byte ranges.
+
+    Full-file and open-ended range responses hand the file object to the
+    server's ``wsgi.file_wrapper`` after seeking to the range start, so
+    gunicorn sends it with ``os.sendfile`` instead of copying it through
+    Python. With ``accel_prefix`` set, the response only carries an
+    ``X-Accel-Redirect`` header and nginx serves the file (ranges included)
+    from its internal location. ``on_close`` runs once the body is done.
+
+    Returns None if the file does not exist.
+    """
+    path = safe_join(directory, filename)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    if st is None or not os.path.isfile(path):
+        if on_close:
+            on_close()
+        return None
+
+    etag = file_etag(st)
+    last_modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    headers = {
+        'Content-Disposition': content_disposition_header(download_name or os.path.basename(filename)),
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        if on_close:
+            on_close()
+        return Response(status=304, headers=headers)
+
+    if accel_prefix:
+        if on_close:
+            on_close()
+        headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(filename)
+        return Response(status=200, mimetype=mimetype, headers=headers)
+
+    size = st.st_size
+    start, stop, status = 0, size, 200
+    if request.range is not None and _range_allowed(etag, st):
+        byte_range = request.range.range_for_length(size) if len(request.range.ranges) == 1 else None
+        if byte_range is None and len(request.range.ranges) == 1:
+            if on_close:
+                on_close()
+            return Response(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        if byte_range is not None:
+            # Multi-range requests fall through to a plain 200 with the whole file
+            start, stop = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    headers['Content-Length'] = str(stop - start)
+    if request.method == 'HEAD':
+        # The server never iterates (or closes) the body of a HEAD response
+        if on_close:
+            on_close()
+        return Response(status=status, mimetype=mimetype, headers=headers)
+
+    f = _ServedFile(path, on_close)
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if stop == size and file_wrapper is not None:
+        body = file_wrapper(f, BLOCK_SIZE)
+    else:
+        body = _iter_range(f, stop - start)
+
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+
+class _ZipSink:
+    """Write-only, non-seekable target for ZipFile that hands out what was written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(directory, filenames):
+    """Yield a ZIP archive of ``directory/filename`` for each of ``filenames``, built on the fly.
+
+    Entries are stored uncompressed (media files do not shrink) and written
+    with data descriptors, so nothing is buffered beyond one block and no
+    copy of the archive touches the disk. Missing files are skipped.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for filename in filenames:
+            path = safe_join(directory, filename)
+            if not path or not os.path.isfile(path):
+                continue
+            entry = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(filename))
+            with open(path, 'rb') as src, archive.open(entry, 'w') as dest:
+                while True:
+                    chunk = src.read(BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.take()
+                    if data:
+                        yield data
+    yield sink.take()
@@ -0,0 +1,220 @@
+import collections
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+# Leftovers of unfinished yt-dlp/ffmpeg runs: .part/.ytdl files, fragments,
+# per-format streams waiting to be merged and ffmpeg's .temp/.orig files.
+PARTIAL_FILE_RE = re.compile(
+    r'(\.part(-Frag\d+)?|\.ytdl|\.temp\.\w+|\.orig\.\w+|\.f(?:\d+|hls-[\w.-]+|dash-[\w.-]+)\.\w+(\.part)?)$'
+)
+
+
+class StorageManager:
+    """Keeps OUTPUT_DIR under a byte quota and a maximum file age.
+
+    Finished files are evicted least-recently-used first; the last access is
+    kept in the file's atime (set explicitly on every download, so it works on
+    noatime/relatime mounts and is shared between workers). Partial files are
+    only removed once they have not been written for ``partial_grace``
+    seconds, and per-job directories under ``work_dir`` are treated the same
+    way. Pinned paths (files being served, work directories of running jobs)
+    and files finished less than ``fresh_grace`` seconds ago (not yet picked
+    up by the client) are never touched.
+
+    Pins are also recorded as files in ``.pins/`` so that every worker
+    sharing the directory sees them. Each sweep refreshes this manager's pin
+    files; pins not refreshed for ``pin_ttl`` seconds (their worker died) are
+    ignored and removed, so sweeps must run more often than that.
+    """
+
+    def __init__(self, directory, max_bytes, max_age, work_dir=None, partial_grace=1800, fresh_grace=300,
+                 on_evict=None, pin_ttl=600):
+        self.directory = directory
+        self.work_dir = work_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.partial_grace = partial_grace
+        self.fresh_grace = fresh_grace
+        self.on_evict = on_evict
+        self.pin_ttl = pin_ttl
+        self.pin_dir = os.path.join(directory, '.pins')
+        self._owner = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._pins = collections.Counter()
+
+    def pin(self, filename):
+        with self._lock:
+            self._pins[filename] += 1
+            if self._pins[filename] == 1:
+                self._write_pin(filename)
+
+    def unpin(self, filename):
+        with self._lock:
+            self._pins[filename] -= 1
+            if self._pins[filename] <= 0:
+                del self._pins[filename]
+                try:
+                    os.remove(self._pin_path(filename))
+                except OSError:
+                    pass
+
+    def is_pinned(self, filename):
+        return _pin_key(filename) in self._active_pins(time.time())
+
+    def _pin_path(self, filename):
+        return os.path.join(self.pin_dir, f'{_pin_key(filename)}.{self._owner}')
+
+    def _write_pin(self, filename):
+        try:
+            os.makedirs(self.pin_dir, exist_ok=True)
+            with open(self._pin_path(filename), 'w') as f:
+                f.write(filename)
+        except OSError as e:
+            logging.warning(f"Could not record pin on {filename}: {str(e)}")
+
+    def _active_pins(self, now):
+        """Keys of the paths pinned by this or any other worker sharing the directory."""
+        with self._lock:
+            pins = {_pin_key(filename) for filename in self._pins}
+        try:
+            with os.scandir(self.pin_dir) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime < self.pin_ttl:
+                            pins.add(entry.name.split('.')[0])
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+        return pins
+
+    def _refresh_pins(self, now):
+        """Keep this manager's pin files fresh and drop the stale ones of workers that went away."""
+        with self._lock:
+            for filename in self._pins:
+                try:
+                    os.utime(self._pin_path(filename))
+                except FileNotFoundError:
+                    self._write_pin(filename)
+                except OSError:
+                    pass
+        try:
+            with os.scandir(self.pin_dir) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime > self.pin_ttl:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def touch(self, filename):
+        """Record an access to ``filename`` for LRU purposes (mtime is left alone)."""
+        path = os.path.join(self.directory, filename)
+        try:
+            # In nanoseconds: a float mtime would lose precision and change the file's ETag
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except OSError as e:
+            logging.warning(f"Could not record access to {filename}: {str(e)}")
+
+    def usage(self):
+        total = 0
+        count = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    total += entry.stat().st_size
+                    count += 1
+        return {'bytes': total, 'files': count, 'max_bytes': self.max_bytes, 'max_age': self.max_age}
+
+    def sweep(self):
+        """Remove stale partial files, expired files and LRU files over quota."""
+        now = time.time()
+        self._refresh_pins(now)
+        pins = self._active_pins(now)
+        finished = []
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Dotfiles are our own bookkeeping (e.g. the output cache index)
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                st = entry.stat()
+                if PARTIAL_FILE_RE.search(entry.name):
+                    if now - st.st_mtime > self.partial_grace:
+                        if self._remove(entry.name, 'orphaned partial file', pins):
+                            removed += 1
+                elif now - max(st.st_atime, st.st_mtime) > self.max_age:
+                    if self._remove(entry.name, 'expired', pins):
+                        removed += 1
+                else:
+                    finished.append((max(st.st_atime, st.st_mtime), st.st_size, entry.name))
+
+        removed += self._sweep_work_dirs(now, pins)
+
+        total = sum(size for _, size, _ in finished)
+        for last_used, size, name in sorted(finished):
+            if total <= self.max_bytes or now - last_used < self.fresh_grace:
+                break
+            if self._remove(name, 'over quota', pins):
+                total -= size
+                removed += 1
+        if removed:
+            logging.info(f"Storage sweep removed {removed} file(s), {total} bytes in use")
+        return removed
+
+    def _sweep_work_dirs(self, now, pins):
+        if not self.work_dir or not os.path.isdir(self.work_dir):
+            return 0
+        removed = 0
+        with os.scandir(self.work_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir() or _pin_key(entry.path) in pins:
+                    continue
+                last_write = entry.stat().st_mtime
+                for root, _, files in os.walk(entry.path):
+                    for name in files:
+                        try:
+                            last_write = max(last_write, os.stat(os.path.join(root, name)).st_mtime)
+                        except OSError:
+                            pass
+                if now - last_write > self.partial_grace:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logging.info(f"Removed abandoned job directory {entry.name}")
+                    removed += 1
+        return removed
+
+    def _remove(self, filename, reason, pins):
+        if _pin_key(filename) in pins:
+            return False
+        try:
+            os.remove(os.path.join(self.directory, filename))
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logging.warning(f"Could not remove {filename}: {str(e)}")
+            return False
+        logging.info(f"Evicted {filename} ({reason})")
+        if self.on_evict:
+            self.on_evict(filename)
+        return True
+
+    def run_janitor(self, interval, sleep=time.sleep):
+        """Sweep forever, every ``interval`` seconds. Meant for a background task."""
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Error in storage janitor: {str(e)}")
+            sleep(interval)
+
+
+def _pin_key(filename):
+    return hashlib.sha1(filename.encode('utf-8')).hexdigest()[:20]
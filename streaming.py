@@ -0,0 +1,108 @@
+import logging
+import subprocess
+
+CHUNK_SIZE = 64 * 1024
+
+# Codecs that can be stream-copied into a (fragmented) MP4 container
+MP4_VIDEO_CODECS = ('avc1', 'h264', 'hev1', 'hvc1', 'h265', 'av01', 'vp09', 'vp9')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'opus', 'mp3', 'ac-3', 'ec-3', 'flac')
+
+# Per output format: ffmpeg encoding arguments and the response mimetype
+STREAM_FORMATS = {
+    'mp3': (['-vn', '-c:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3'], 'audio/mpeg'),
+    'wav': (['-vn', '-c:a', 'pcm_s16le', '-f', 'wav'], 'audio/wav'),
+    # Fragmented MP4 can be written to a pipe because the moov atom comes first
+    'mp4': (['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof'], 'video/mp4'),
+}
+
+
+def codec_fits_mp4(codec, allowed):
+    return bool(codec) and codec != 'none' and codec.split('.')[0].lower() in allowed
+
+
+def selected_formats(info):
+    """The format dicts the last format selection picked for ``info`` (one, or video + audio).
+
+    ``requested_formats`` left over from an earlier selection (which picked a
+    different ``format_id``) is ignored.
+    """
+    requested = info.get('requested_formats')
+    if requested and '+'.join(fmt.get('format_id', '') for fmt in requested) == info.get('format_id'):
+        return requested
+    return [info]
+
+
+def fits_mp4(info):
+    """True when every stream selected for ``info`` can be copied into MP4 without transcoding.
+
+    Streams with unknown codecs count as not fitting.
+    """
+    for fmt in selected_formats(info):
+        for codec, allowed in ((fmt.get('vcodec'), MP4_VIDEO_CODECS), (fmt.get('acodec'), MP4_AUDIO_CODECS)):
+            if codec != 'none' and not codec_fits_mp4(codec, allowed):
+                return False
+    return True
+
+
+def build_ffmpeg_command(info, format_type, ffmpeg='ffmpeg'):
+    """ffmpeg command that reads the selected stream URL(s) and writes ``format_type`` to stdout.
+
+    ``info`` must already have gone through format selection.
+    """
+    encode_args, _ = STREAM_FORMATS[format_type]
+    formats = selected_formats(info)
+
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin']
+    for fmt in formats:
+        headers = fmt.get('http_headers') or info.get('http_headers') or {}
+        if headers:
+            cmd += ['-headers', ''.join(f'{key}: {value}\r\n' for key, value in headers.items())]
+        cmd += ['-i', fmt['url']]
+
+    if format_type == 'mp4':
+        if len(formats) > 1:
+            cmd += ['-map', '0:v:0', '-map', '1:a:0']
+        video_codec = next((f.get('vcodec') for f in formats if f.get('vcodec') not in (None, 'none')), None)
+        audio_codec = next((f.get('acodec') for f in formats if f.get('acodec') not in (None, 'none')), None)
+        # Stream copy whenever the codecs fit in MP4, transcode only when they don't
+        cmd += ['-c:v', 'copy' if codec_fits_mp4(video_codec, MP4_VIDEO_CODECS) else 'libx264']
+        if audio_codec:
+            cmd += ['-c:a', 'copy' if codec_fits_mp4(audio_codec, MP4_AUDIO_CODECS) else 'aac']
+        if video_codec and not codec_fits_mp4(video_codec, MP4_VIDEO_CODECS):
+            cmd += ['-preset', 'veryfast']
+
+    return cmd + encode_args + ['pipe:1']
+
+
+def stream_ffmpeg(cmd, popen=subprocess.Popen):
+    """Run ``cmd`` and yield its stdout in chunks.
+
+    ``popen`` is the Popen class to start it with; code on an event loop
+    passes one with non-blocking pipes (see executor.hub_popen).
+    The process is killed if the client goes away (the generator is closed
+    before ffmpeg finished), so an abandoned stream does not keep a transcode
+    running.
+    """
+    logging.info(f"Starting streaming ffmpeg: {' '.join(cmd[:4])} ...")
+    proc = popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    sent = 0
+    try:
+        while True:
+            chunk = proc.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sent += len(chunk)
+            yield chunk
+        proc.wait()
+        if proc.returncode != 0:
+            error = proc.stderr.read().decode('utf-8', 'replace').strip()
+            logging.error(f"Streaming ffmpeg exited with {proc.returncode}: {error}")
+        else:
+            logging.info(f"Stream finished, sent {sent} bytes")
+    finally:
+        if proc.poll() is None:
+            logging.info(f"Client went away after {sent} bytes, stopping ffmpeg")
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Check that a cached info dict is selected again for every request (no network
+needed; the formats are served from a local HTTP server).
+
+The metadata cache keeps the info dict of one extraction for every later
+request, so a format choice made earlier (the default video + audio pair)
+must not leak into an audio-only fetch.
+"""
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+
+from pipeline import fetch_media, select_formats, unselected_info, ydl_pool
+from streaming import build_ffmpeg_command
+
+FILES = {'v.mp4': b'v' * 4096, 'a.m4a': b'a' * 2048}
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        Handler.requested.append(self.path.lstrip('/'))
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory):
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), lambda *args: Handler(*args, directory=directory),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_info(base_url):
+    """An info dict as it comes out of an extraction with the default format selection."""
+    formats = [
+        {'format_id': 'v', 'url': f'{base_url}/v.mp4', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 360},
+        {'format_id': 'a', 'url': f'{base_url}/a.m4a', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128},
+    ]
+    info = {
+        'id': 'cached', 'title': 'Cached', 'extractor': 'generic', 'extractor_key': 'Generic',
+        'webpage_url': f'{base_url}/watch', 'formats': formats,
+    }
+    with ydl_pool.get({'quiet': True, 'format': 'bestvideo+bestaudio'}) as ydl:
+        return ydl.sanitize_info(ydl.process_ie_result(info, download=False))
+
+
+def check_cached_info_is_unselected(base_url):
+    """The info dict that goes into the cache should carry no format selection"""
+    print("Testing the info dict kept for the cache...")
+    with ydl_pool.get({'quiet': True}) as ydl:
+        info = unselected_info(ydl, make_info(base_url))
+    leftovers = sorted(key for key in ('requested_formats', 'format_id', 'url', 'ext', 'vcodec') if key in info)
+    if not leftovers and len(info['formats']) == 2:
+        print("✓ Only the available formats are kept")
+        return True
+    print(f"✗ Selection left in the cached info: {leftovers}")
+    return False
+
+
+def check_audio_fetch_from_cached_info(base_url, work_dir):
+    """Fetching bestaudio from a cached, already selected info dict should download one format"""
+    print("Testing a bestaudio fetch from a cached info dict...")
+    Handler.requested.clear()
+    opts = {
+        'quiet': True, 'noprogress': True, 'format': 'bestaudio/best',
+        'outtmpl': os.path.join(work_dir, '%(title)s.%(ext)s'),
+    }
+    info, _ = fetch_media(opts, f'{base_url}/watch', make_info(base_url))
+    downloads = info.get('requested_downloads') or []
+    print(f"  Requested from the server: {Handler.requested}")
+    if [d.get('format_id') for d in downloads] == ['a'] and Handler.requested == ['a.m4a']:
+        print("✓ Only the audio format was fetched")
+        return True
+    print(f"✗ Fetched formats {[d.get('format_id') for d in downloads]}")
+    return False
+
+
+def stream_inputs(info, selector, format_type):
+    info = select_formats(info, {'quiet': True, 'format': selector})
+    cmd = build_ffmpeg_command(info, format_type)
+    return [os.path.basename(cmd[i + 1]) for i, arg in enumerate(cmd) if arg == '-i']
+
+
+def check_stream_from_cached_info(base_url):
+    """A stream should read only the formats selected for its own output format"""
+    print("Testing stream inputs from a cached info dict...")
+    info = make_info(base_url)
+    mp3_inputs = stream_inputs(info, 'bestaudio/best', 'mp3')
+    mp4_inputs = stream_inputs(info, 'bestvideo[height<=360]+bestaudio', 'mp4')
+    print(f"  mp3 inputs: {mp3_inputs}, mp4 inputs: {mp4_inputs}")
+    if mp3_inputs == ['a.m4a'] and mp4_inputs == ['v.mp4', 'a.m4a']:
+        print("✓ Each stream reads only its own selection")
+        return True
+    print("✗ Stream inputs came from another selection")
+    return False
+
+
+if __name__ == "__main__":
+    print("Cached info dicts")
+    print("=" * 50)
+
+    work_dir = tempfile.mkdtemp(prefix='cached-info-test-')
+    serve_dir = os.path.join(work_dir, 'served')
+    os.makedirs(serve_dir)
+    for name, data in FILES.items():
+        with open(os.path.join(serve_dir, name), 'wb') as f:
+            f.write(data)
+    server = serve(serve_dir)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        results = [
+            check_cached_info_is_unselected(base_url),
+            check_audio_fetch_from_cached_info(base_url, work_dir),
+            check_stream_from_cached_info(base_url),
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("=" * 50)
+    print(f"{sum(results)}/{len(results)} checks passed")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Check fragment/chunk download tuning and the shared connection pool against a
+local HTTP/HLS fixture server (no network access needed).
+
+The fixture serves an HLS playlist whose segments each take a little while to
+arrive, like fragments from a distant CDN, and a large progressive file that
+supports Range requests.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from yt_dlp import YoutubeDL
+
+import http_pool
+
+SEGMENTS = 24
+SEGMENT_BYTES = 64 * 1024
+SEGMENT_DELAY = 0.1  # seconds per segment request
+PROGRESSIVE_BYTES = 8 * 1024 * 1024
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is visible
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        if self.path == '/hls/index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(SEGMENTS):
+                lines += ['#EXTINF:2.0,', f'seg{i}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            self._send(200, '\n'.join(lines).encode() + b'\n', 'application/vnd.apple.mpegurl', body)
+        elif self.path.startswith('/hls/seg'):
+            time.sleep(SEGMENT_DELAY)
+            self._send(200, b'\x47' * SEGMENT_BYTES, 'video/mp2t', body)
+        elif self.path == '/progressive.mp4':
+            data = b'\0' * PROGRESSIVE_BYTES
+            start, end = 0, len(data) - 1
+            status = 200
+            if self.headers.get('Range'):
+                with self.server.lock:
+                    self.server.range_requests += 1
+                first, _, last = self.headers['Range'].split('=', 1)[1].partition('-')
+                start, end = int(first), min(int(last) if last else end, end)
+                status = 206
+            extra = {'Content-Range': f'bytes {start}-{end}/{len(data)}'} if status == 206 else {}
+            self._send(status, data[start:end + 1], 'video/mp4', body, extra)
+        else:
+            self._send(404, b'not found', 'text/plain', body)
+
+    def _send(self, status, data, content_type, body, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients closing keep-alive connections early are expected
+
+
+def start_fixture_server():
+    server = FixtureServer(('127.0.0.1', 0), FixtureHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.range_requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def download(url, work_dir, **opts):
+    ydl_opts = {
+        'quiet': True,
+        'noprogress': True,
+        'fixup': 'never',  # fixture segments are not real media
+        'outtmpl': '%(id)s.%(ext)s',
+        'paths': {'home': work_dir},
+        **opts,
+    }
+    started = time.monotonic()
+    with YoutubeDL(ydl_opts) as ydl:
+        ydl.extract_info(url, download=True)
+    return time.monotonic() - started
+
+
+def check_concurrent_fragments(server, work_dir):
+    """Concurrent fragment downloads should cut the time for a slow HLS stream"""
+    url = f'http://127.0.0.1:{server.server_port}/hls/index.m3u8'
+    print("Testing concurrent HLS fragment downloads...")
+    sequential = download(url, os.path.join(work_dir, 'seq'), concurrent_fragment_downloads=1)
+    concurrent = download(url, os.path.join(work_dir, 'par'), concurrent_fragment_downloads=8)
+    print(f"  1 fragment at a time: {sequential:.2f}s, 8 at a time: {concurrent:.2f}s")
+    if concurrent < sequential * 0.6:
+        print("✓ Concurrent fragment downloads are faster")
+        return True
+    print("✗ Concurrent fragment downloads were not faster")
+    return False
+
+
+def check_chunked_progressive(server, work_dir):
+    """http_chunk_size should split a progressive download into Range requests"""
+    url = f'http://127.0.0.1:{server.server_port}/progressive.mp4'
+    print("Testing chunked progressive download...")
+    before = server.range_requests
+    download(url, os.path.join(work_dir, 'chunked'), http_chunk_size=1024 * 1024)
+    requests_made = server.range_requests - before
+    print(f"  {requests_made} range requests for {PROGRESSIVE_BYTES // (1024 * 1024)} MiB")
+    if requests_made >= PROGRESSIVE_BYTES // (1024 * 1024):
+        print("✓ Progressive download was fetched in chunks")
+        return True
+    print("✗ Progressive download was not chunked")
+    return False
+
+
+def check_shared_pool(server, work_dir):
+    """With the shared pool, a second job should reuse the first job's connections"""
+    url = f'http://127.0.0.1:{server.server_port}/hls/index.m3u8'
+    print("Testing connection reuse across jobs...")
+    if not http_pool.install_shared_pool():
+        print("✗ Shared pool could not be installed")
+        return False
+    download(url, os.path.join(work_dir, 'pool1'), concurrent_fragment_downloads=4)
+    before = server.connections
+    download(url, os.path.join(work_dir, 'pool2'), concurrent_fragment_downloads=4)
+    opened = server.connections - before
+    print(f"  Second job opened {opened} new connections for {SEGMENTS + 2} requests")
+    if opened <= 1:
+        print("✓ Connections were reused across jobs")
+        return True
+    print("✗ Connections were not reused")
+    return False
+
+
+if __name__ == "__main__":
+    print("Fragment download fixture tests")
+    print("=" * 50)
+
+    server = start_fixture_server()
+    work_dir = tempfile.mkdtemp(prefix='fragment-test-')
+    try:
+        results = [
+            check_concurrent_fragments(server, work_dir),
+            check_chunked_progressive(server, work_dir),
+            check_shared_pool(server, work_dir),
+        ]
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("=" * 50)
+    print(f"{sum(results)}/{len(results)} checks passed")
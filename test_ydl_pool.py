@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Check the YoutubeDL pool in spawned yt-dlp worker processes, set up the way
+app.py sets them up (BlockingExecutor with pipeline.init_worker, warm-up
+included; no network needed).
+
+Jobs spread over the worker processes check instances out one after the
+other and use the cookie jar the instances share. Each process should reuse
+its warm instances, parse the cookie file once, and never import eventlet
+(the workers start without it).
+"""
+
+import functools
+import os
+import shutil
+import sys
+import tempfile
+
+from executor import YT_DLP, BlockingExecutor
+from pipeline import init_worker, worker_stats, ydl_pool
+
+PROCESSES = 2
+JOBS = 8
+ROUNDS = 20
+TIMEOUT = 120
+
+COOKIES = """# Netscape HTTP Cookie File
+.example.com\tTRUE\t/\tFALSE\t4102444800\tsession\tabc
+.example.com\tTRUE\t/\tTRUE\t4102444800\tprefs\tdef
+"""
+
+
+def use_pool(cookie_path, rounds):
+    """Runs in a worker process: check instances out like consecutive jobs do."""
+    ydl_opts = {'quiet': True, 'cookiefile': cookie_path}
+    loads_before = ydl_pool.stats()['cookie_loads']
+    for _ in range(rounds):
+        with ydl_pool.get(ydl_opts) as ydl:
+            ydl.cookiejar.clear_expired_cookies()
+            count = len(ydl.cookiejar)
+    return {
+        **worker_stats(), 'cookies': count, 'cookie_loads_before': loads_before,
+        'eventlet': 'eventlet' in sys.modules,
+    }
+
+
+def check_worker_processes(work_dir):
+    """Jobs in warmed worker processes should reuse instances and share the cookies"""
+    print("Testing checkouts in yt-dlp worker processes...")
+    cookie_path = os.path.join(work_dir, 'cookies.txt')
+    with open(cookie_path, 'w') as f:
+        f.write(COOKIES)
+    executor = BlockingExecutor(
+        'threading', threads=2, yt_dlp_processes=PROCESSES,
+        yt_dlp_initializer=functools.partial(init_worker, warm=True),
+    )
+    outcomes = executor.map_in_process(
+        use_pool, [(cookie_path, ROUNDS)] * JOBS, timeout=TIMEOUT, stage='pool check', pool=YT_DLP,
+    )
+    errors = [error for _, error in outcomes if error is not None]
+    if errors:
+        print(f"✗ Jobs failed: {errors}")
+        return False
+
+    # The last report of each process has its final counters, the first its counters after warm-up
+    by_process, warm_loads = {}, {}
+    for result, _ in outcomes:
+        last = by_process.get(result['pid'])
+        if last is None or result['ydl_pool']['reused'] > last['ydl_pool']['reused']:
+            by_process[result['pid']] = result
+        before = result['cookie_loads_before']
+        warm_loads[result['pid']] = min(warm_loads.get(result['pid'], before), before)
+    for pid, result in by_process.items():
+        print(f"  process {pid}: {result['ydl_pool']}")
+
+    ok = True
+    if any(result['cookies'] != 2 for result, _ in outcomes):
+        print("✗ A job did not see the shared cookies")
+        ok = False
+    if any(result['eventlet'] for result, _ in outcomes):
+        print("✗ eventlet was imported in a worker process")
+        ok = False
+    for result in by_process.values():
+        stats = result['ydl_pool']
+        if stats['cookie_loads'] - warm_loads[result['pid']] != 1 or stats['reused'] < stats['created']:
+            print(f"✗ Process {result['pid']} did not reuse its instances: {stats}")
+            ok = False
+    if ok:
+        print(f"✓ {JOBS} jobs x {ROUNDS} checkouts in {len(by_process)} process(es) reused warm instances")
+    return ok
+
+
+if __name__ == "__main__":
+    print("YoutubeDL pool in yt-dlp worker processes")
+    print("=" * 50)
+
+    work_dir = tempfile.mkdtemp(prefix='ydl-pool-test-')
+    try:
+        results = [check_worker_processes(work_dir)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("=" * 50)
+    print(f"{sum(results)}/{len(results)} checks passed")
@@ -0,0 +1,47 @@
+# Process pool entry points for ffmpeg postprocessing. Kept separate from
+# app.py so that worker processes (started with the "spawn" method) import
+# only what they need, not the Flask app.
+import resource
+
+from executor import deadline
+from streaming import fits_mp4
+from ydl_pool import YoutubeDLPool
+
+# How a fetched video becomes the MP4 output, cheapest first
+MP4_NO_CONVERSION = 'none'  # fetched (or merged) straight into MP4
+MP4_REMUX = 'remux'  # stream copy into an MP4 container
+MP4_TRANSCODE = 'transcode'  # full re-encode to H.264/AAC
+
+# Each worker process keeps a YoutubeDL per postprocessor setup between encodes
+_ydl_pool = YoutubeDLPool(max_idle=1)
+
+
+def run_postprocessors(ydl_opts, info, source_path, timeout=None):
+    """Apply the postprocessors configured in ``ydl_opts`` to ``source_path``.
+
+    Returns the path of the final file and the CPU seconds used by the ffmpeg
+    processes it ran. A timeout raises StageTimeout from inside yt-dlp's
+    ffmpeg call, which kills the ffmpeg process on its way out.
+    """
+    # yt-dlp waits for every ffmpeg it starts, so their CPU time ends up in RUSAGE_CHILDREN
+    before = _children_cpu_seconds()
+    with deadline(timeout, 'postprocessing'), _ydl_pool.get(ydl_opts) as ydl:
+        info = ydl.post_process(source_path, info)
+    return info['filepath'], _children_cpu_seconds() - before
+
+
+def _children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def mp4_postprocessors(info):
+    """Pick the cheapest way to MP4 for what was actually fetched.
+
+    Returns one of the MP4_* paths and the postprocessors that implement it.
+    """
+    if info.get('ext') == 'mp4':
+        return MP4_NO_CONVERSION, []
+    if fits_mp4(info):
+        return MP4_REMUX, [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mp4'}]
+    return MP4_TRANSCODE, [{'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'}]
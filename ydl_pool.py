@@ -0,0 +1,196 @@
+# Warm, reusable YoutubeDL instances. Building a YoutubeDL loads the extractor
+# registry, parses the cookie file and sets up request handlers; the pool does
+# that once per option profile and hands the instance to one caller at a time.
+# yt-dlp itself is imported on first use (or by preload()), not at import time;
+# code that imports from yt_dlp itself should call preload() first, since
+# importing it from two threads at once fails on its circular imports.
+# The pool lives in the yt-dlp worker processes (see executor.py), which start
+# without eventlet's monkey patching, so its threading locks are real ones.
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Options that change from job to job and are set on a pooled instance for
+# each use; every other option is part of the profile the instance was built for.
+JOB_OPTIONS = ('paths', 'progress_hooks')
+
+
+def profile_key(ydl_opts):
+    """The option profile of ``ydl_opts``: everything but the per-job options."""
+    return json.dumps(
+        {k: v for k, v in ydl_opts.items() if k not in JOB_OPTIONS}, sort_keys=True, default=repr,
+    )
+
+
+class YoutubeDLPool:
+    """YoutubeDL instances kept warm per option profile (extract-only, mp3, wav, mp4 per quality, ...).
+
+    ``get()`` checks out an idle instance built for the same options, or
+    builds one, and takes it back afterwards. At most ``max_idle`` instances
+    are kept per profile, and each is retired after ``max_uses`` checkouts.
+    Instances with a ``cookiefile`` share one cookie jar per file, parsed
+    once and again only when the file's mtime changes.
+    """
+
+    def __init__(self, max_idle=4, max_uses=200):
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._on_load = []
+        self._idle = {}  # profile key -> [(ydl, cookie jar, uses)]
+        self._jars = {}  # cookie file -> (mtime, jar)
+        self._counts = {'created': 0, 'reused': 0, 'retired': 0, 'cookie_loads': 0}
+
+    def on_load(self, fn):
+        """Call ``fn`` once yt-dlp is imported, before any instance is built (e.g. to register request handlers)."""
+        with self._load_lock:
+            if not self._loaded:
+                self._on_load.append(fn)
+                return
+        fn()
+
+    def preload(self):
+        """Import yt-dlp and load its extractors now rather than on the first request."""
+        with self._load_lock:
+            if self._loaded:
+                return
+            started = time.monotonic()
+            from yt_dlp import YoutubeDL
+
+            # The first instance in a process loads the plugins and the extractor classes
+            YoutubeDL({'quiet': True}).close()
+            for fn in self._on_load:
+                fn()
+            self._loaded = True
+        logging.info(f"Loaded yt-dlp in {time.monotonic() - started:.2f}s")
+
+    def warm(self, profiles):
+        """Preload, then build an idle instance for each distinct profile among the option dicts in ``profiles``."""
+        self.preload()
+        for ydl_opts in {profile_key(opts): opts for opts in profiles}.values():
+            with self.get(ydl_opts):
+                pass
+
+    @contextlib.contextmanager
+    def get(self, ydl_opts):
+        """A YoutubeDL for ``ydl_opts``, to be used by the caller alone inside the ``with`` block.
+
+        An instance whose block raises is closed instead of being reused.
+        """
+        self.preload()
+        key = profile_key(ydl_opts)
+        jar = self._cookie_jar(ydl_opts.get('cookiefile'))
+        ydl, uses = self._checkout(key, jar)
+        if ydl is None:
+            ydl, uses = self._build(ydl_opts, jar), 0
+        # Per-job state; everything else stays as built for the profile
+        ydl.params['paths'] = ydl_opts.get('paths') or {}
+        ydl._progress_hooks = list(ydl_opts.get('progress_hooks') or [])
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+        try:
+            yield ydl
+        except BaseException:
+            _close(ydl)
+            raise
+        ydl._progress_hooks = []
+        self._checkin(key, ydl, jar, uses + 1)
+
+    def close(self):
+        """Close idle instances and write each cookie jar back to its file, unless the file changed meanwhile."""
+        with self._lock:
+            idle = [ydl for entries in self._idle.values() for ydl, _, _ in entries]
+            self._idle.clear()
+            jars = list(self._jars.items())
+        for ydl in idle:
+            _close(ydl)
+        for path, (mtime, jar) in jars:
+            if jar is not None and _mtime(path) == mtime:
+                jar.save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._idle),
+                'idle': sum(len(entries) for entries in self._idle.values()),
+                **self._counts,
+            }
+
+    def _build(self, ydl_opts, jar):
+        from yt_dlp import YoutubeDL
+
+        ydl = YoutubeDL({k: v for k, v in ydl_opts.items() if k not in JOB_OPTIONS})
+        if jar is not None:
+            # Takes the place of the jar yt-dlp would parse from the file for this instance
+            ydl.__dict__['cookiejar'] = jar
+        with self._lock:
+            self._counts['created'] += 1
+        return ydl
+
+    def _checkout(self, key, jar):
+        stale = []
+        found = (None, 0)
+        with self._lock:
+            entries = self._idle.get(key, [])
+            while entries:
+                ydl, ydl_jar, uses = entries.pop()
+                if ydl_jar is jar:
+                    self._counts['reused'] += 1
+                    found = (ydl, uses)
+                    break
+                # Built with cookies from before the file changed
+                stale.append(ydl)
+        for ydl in stale:
+            _close(ydl)
+        return found
+
+    def _checkin(self, key, ydl, jar, uses):
+        with self._lock:
+            entries = self._idle.setdefault(key, [])
+            current = self._jars.get(ydl.params.get('cookiefile'), (None, None))[1]
+            if uses < self.max_uses and len(entries) < self.max_idle and jar is current:
+                entries.append((ydl, jar, uses))
+                return
+            self._counts['retired'] += 1
+        _close(ydl)
+
+    def _cookie_jar(self, path):
+        """The shared jar for cookie file ``path``, parsed again only if its mtime changed."""
+        if path is None:
+            return None
+        from yt_dlp.cookies import YoutubeDLCookieJar
+
+        mtime = _mtime(path)
+        # Under the lock, so threads arriving together parse the file once
+        with self._lock:
+            loaded_mtime, jar = self._jars.get(path, (None, None))
+            if jar is not None and loaded_mtime == mtime:
+                return jar
+            jar = YoutubeDLCookieJar(path)
+            if mtime is not None:
+                jar.load()
+            self._jars[path] = (mtime, jar)
+            self._counts['cookie_loads'] += 1
+        logging.info(f"Loaded {len(jar)} cookie(s) from {path}")
+        return jar
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _close(ydl):
+    # Without saving cookies: the jar is shared, and written back by YoutubeDLPool.close()
+    ydl.params['cookiefile'] = None
+    try:
+        ydl.close()
+    except Exception as e:
+        logging.warning(f"Error closing YoutubeDL: {str(e)}")